@@ -0,0 +1,222 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
+
+
+class CrackConfig(BaseModel):
+    """验证码识别配置"""
+
+    executor: Literal["inline", "thread", "process"] = Field(
+        "thread",
+        description=(
+            "识别流水线的执行方式：inline 在事件循环内直接运行，"
+            "thread/process 分别提交到线程池/进程池"
+        ),
+    )
+    workers: int = Field(
+        2,
+        ge=1,
+        description=(
+            "线程池/进程池的工作者数量。每个工作者有各自的 ddddocr ONNX 会话，"
+            "而 ONNX 会话本身会使用多个线程，工作者过多会超额占用 CPU 并成倍增加模型内存"
+        ),
+    )
+    min_confidence: float = Field(
+        0.0,
+        ge=0.0,
+        le=1.0,
+        description=(
+            "匹配置信度（最低的字符相似度）低于该值时直接放弃本次验证码，不再提交校验"
+        ),
+    )
+    max_background_distance: float | None = Field(
+        None,
+        gt=0,
+        description=(
+            "大图与最接近的背景模板的距离（缩略图每个像素通道的均方根差，0-255）"
+            "超过该值时视为未收录的背景，直接放弃本次验证码；默认不检查，"
+            "启用前先用 scripts/bench_crack.py --max-background-distance 在真实语料上确认"
+        ),
+    )
+    profile_rate: float = Field(
+        0.0,
+        ge=0.0,
+        le=1.0,
+        description=(
+            "对该比例的识别过程运行 pyinstrument 采样分析器并保存 HTML 报告，"
+            "0 表示关闭，需要安装 pyinstrument"
+        ),
+    )
+    profile_dir: str = Field("profiles", description="采样分析报告的保存目录")
+
+
+class AuthPoolConfig(BaseModel):
+    """验证码认证池配置"""
+
+    low_watermark: int = Field(
+        2, ge=0, description="池中可用认证数量低于该值时开始后台补充"
+    )
+    high_watermark: int = Field(5, ge=1, description="后台补充到该数量后停止")
+    concurrency: int = Field(2, ge=1, description="后台同时求解的验证码数量")
+    ttl: float = Field(
+        300, gt=0, description="认证信息（uuid, sign）的有效期（秒），过期后移出池"
+    )
+    max_uses: int | None = Field(
+        None, ge=1, description="每份认证信息最多使用的次数，默认不限"
+    )
+    retry_interval: float = Field(
+        1, ge=0, description="求解失败后的初始重试间隔（秒），连续失败时指数退避"
+    )
+    acquire_timeout: float | None = Field(
+        30,
+        gt=0,
+        description="请求等待可用认证的最长时间（秒），超时返回 503，为空时不限",
+    )
+
+    @model_validator(mode="after")
+    def check_watermarks(self):
+        if self.low_watermark > self.high_watermark:
+            raise ValueError("low_watermark 不能大于 high_watermark")
+        return self
+
+
+class AdaptiveConcurrencyConfig(BaseModel):
+    """上游并发的 AIMD 自适应控制配置
+
+    上游正常时每个往返周期增加 increase 个并发，出现网络错误、限流
+    或延迟突增时乘以 decrease 收缩。
+    """
+
+    enabled: bool = Field(True, description="是否启用自适应并发控制")
+    initial: int = Field(8, ge=1, description="初始并发上限")
+    min_limit: int = Field(1, ge=1, description="并发上限的最小值")
+    max_limit: int = Field(64, ge=1, description="并发上限的最大值")
+    increase: float = Field(1, gt=0, description="上游正常时每个往返周期增加的并发数")
+    decrease: float = Field(
+        0.5, gt=0, lt=1, description="出现错误或延迟突增时并发上限乘以该系数"
+    )
+    latency_factor: float = Field(
+        2.0, gt=1, description="延迟超过该端点基线（平滑平均）的多少倍视为延迟突增"
+    )
+    cooldown: float = Field(
+        1.0, ge=0, description="两次收缩之间的最短间隔（秒），避免同一波错误重复收缩"
+    )
+
+    @model_validator(mode="after")
+    def check_limits(self):
+        if not self.min_limit <= self.initial <= self.max_limit:
+            raise ValueError("需要满足 min_limit <= initial <= max_limit")
+        return self
+
+
+class RetryConfig(BaseModel):
+    """上游请求的重试策略"""
+
+    max_attempts: int = Field(3, ge=1, description="每次查询最多尝试的次数（含首次）")
+    base_delay: float = Field(0.5, ge=0, description="首次重试的退避基数（秒）")
+    max_delay: float = Field(10, ge=0, description="单次退避的最长时间（秒）")
+    budget_ratio: float = Field(
+        0.2, ge=0, description="每次查询为重试预算存入的令牌数，即重试量占查询量的比例"
+    )
+    budget_max: int = Field(10, ge=0, description="重试预算最多积累的令牌数")
+
+
+class CircuitBreakerConfig(BaseModel):
+    """上游熔断配置"""
+
+    enabled: bool = Field(True, description="是否启用熔断")
+    failure_threshold: int = Field(
+        5, ge=1, description="连续多少次上游失败（网络错误或限流）后打开熔断器"
+    )
+    reset_timeout: float = Field(
+        30, gt=0, description="熔断器打开后多少秒进入半开状态进行探测"
+    )
+    half_open_max_calls: int = Field(1, ge=1, description="半开状态下放行的探测请求数")
+
+
+class HttpConfig(BaseModel):
+    """上游 HTTP 连接池与超时配置"""
+
+    http2: bool = Field(
+        True, description="是否启用 HTTP/2，同一连接上复用多个请求，需要安装 h2"
+    )
+    max_connections: int = Field(20, ge=1, description="每个会话最多打开的连接数")
+    max_keepalive_connections: int = Field(
+        10, ge=0, description="每个会话最多保持的空闲连接数"
+    )
+    keepalive_expiry: float = Field(
+        30, ge=0, description="空闲连接保持的时间（秒），超过后关闭"
+    )
+    connect_timeout: float = Field(5, gt=0, description="建立连接的超时时间（秒）")
+    read_timeout: float = Field(15, gt=0, description="等待响应数据的超时时间（秒）")
+    write_timeout: float = Field(5, gt=0, description="发送请求数据的超时时间（秒）")
+    pool_timeout: float = Field(
+        10, gt=0, description="等待连接池空闲连接的超时时间（秒）"
+    )
+
+
+class UpstreamConfig(BaseModel):
+    """工信部接口配置"""
+
+    home_url: str = Field(
+        "https://beian.miit.gov.cn/", description="获取 cookie 的首页地址"
+    )
+    api_url: str = Field(
+        "https://hlwicpfwc.miit.gov.cn/icpproject_query/api",
+        description="接口地址前缀，可以指向本地模拟器进行压测",
+    )
+    sessions: int = Field(
+        1, ge=1, description="独立上游会话数量，每个会话有各自的 cookie、token 与认证池"
+    )
+    rate_limit: float | None = Field(
+        None, gt=0, description="每个会话每秒最多发起的请求数，默认不限"
+    )
+    burst: int = Field(1, ge=1, description="每个会话允许的突发请求数")
+    global_rate_limit: float | None = Field(
+        None, gt=0, description="所有会话合计每秒最多发起的请求数，默认不限"
+    )
+    global_burst: int = Field(1, ge=1, description="所有会话合计允许的突发请求数")
+    adaptive: AdaptiveConcurrencyConfig = Field(
+        default_factory=AdaptiveConcurrencyConfig,  # type: ignore
+        description="上游并发的自适应控制",
+    )
+    token_ttl: float = Field(
+        300, gt=0, description="接口未返回有效期时 token 的默认有效期（秒）"
+    )
+    token_refresh_margin: float = Field(
+        30, ge=0, description="在 token 过期前多少秒提前刷新 cookie 与 token"
+    )
+    page_size: int = Field(40, ge=1, description="每页查询的记录数")
+    fetch_all_pages: bool = Field(
+        False,
+        description=(
+            "/query 未命中时获取全部分页结果，否则只获取第一页；"
+            "/query/list 与批量导入总是获取全部分页"
+        ),
+    )
+    max_pages: int | None = Field(
+        None, ge=1, description="单次查询最多获取的页数，默认不限"
+    )
+    page_concurrency: int = Field(
+        2,
+        ge=1,
+        description="单次查询翻页时同时请求的页数，避免一次查询占满所有会话的认证",
+    )
+    retry: RetryConfig = Field(
+        default_factory=RetryConfig,  # type: ignore
+        description="重试策略",
+    )
+    circuit_breaker: CircuitBreakerConfig = Field(
+        default_factory=CircuitBreakerConfig,  # type: ignore
+        description="熔断配置",
+    )
+    http: HttpConfig = Field(
+        default_factory=HttpConfig,  # type: ignore
+        description="HTTP 连接池与超时",
+    )
+
+    @model_validator(mode="after")
+    def check_token_refresh(self):
+        if self.token_refresh_margin >= self.token_ttl:
+            raise ValueError("token_refresh_margin 需要小于 token_ttl")
+        return self
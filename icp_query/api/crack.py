@@ -1,12 +1,15 @@
 import base64
+import functools
+import hashlib
+import itertools
 import logging
 import os
+import threading
+import time
 from pathlib import Path
 
 import cv2
-import ddddocr
 import numpy as np
-import onnxruntime
 
 logging.basicConfig(level=logging.INFO)
 
@@ -19,6 +22,8 @@ def create_onnx_session(model_path: str):
       USE_ONNX_CUDA is not explicitly set to 0/false, we enable CUDA.
     - Fallback to CPUExecutionProvider otherwise.
     """
+    import onnxruntime
+
     available_providers = onnxruntime.get_available_providers()
     use_cuda_env = os.getenv("USE_ONNX_CUDA")
     # Consider a set of accelerated providers (CUDA, TensorRT, CoreML, DML, ROCm, etc.)
@@ -57,42 +62,151 @@ def create_onnx_session(model_path: str):
     return onnxruntime.InferenceSession(model_path, providers=providers)
 
 
-session = create_onnx_session("siamese.onnx")
+# 模型与背景索引在第一次使用时才加载，只导入本模块的进程（命令行工具、数据库模型）不会加载
+_load_lock = threading.Lock()
+_session = None
+_background_index = None
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _load_lock:
+            if _session is None:
+                _session = create_onnx_session("siamese.onnx")
+    return _session
+
 
 SIZE = (500, 190)
+# 背景匹配使用的缩略图尺寸
+THUMBNAIL_SIZE = (50, 20)
 
 
 medium_imgs = Path(__file__).parent.parent / "data" / "medium"
-
-bg_files = [cv2.imread(str(bg_file)) for bg_file in medium_imgs.glob("*.png")]
+# 背景特征的缓存文件，背景模板没有变化时重启后直接读取
+background_cache = medium_imgs.parent / "medium_features.npz"
 
 
-def extract_features(image):
+def extract_features(image) -> np.ndarray:
     # assert size is SIZE
     assert image.shape[1] == SIZE[0] and image.shape[0] == SIZE[1]
 
     blurred = cv2.GaussianBlur(image, (5, 5), 0)
     # gray = cv2.cvtColor(blurred, cv2.COLOR_BGR2GRAY)
-    thumbnail = cv2.resize(blurred, (50, 20), interpolation=cv2.INTER_AREA)
+    thumbnail = cv2.resize(blurred, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
     # hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
     # normalized_hist = cv2.normalize(hist, hist).flatten()
     # mean_color = cv2.mean(blurred)[:3]  # 获取 BGR 三个通道的均值
-    return thumbnail.flatten()
+    # 转为 float32，避免 uint8 相减时溢出回绕
+    return thumbnail.astype(np.float32).ravel()
 
 
-bg_features = [extract_features(bg) for bg in bg_files]
+@functools.lru_cache(maxsize=32)
+def load_background(path: str) -> np.ndarray:
+    """按需读取完整的背景图
 
+    读取一张背景图约 2ms，缓存最近用到的 32 张（约 9MB），背景模板增多时内存不会随之增长
+    """
+    return cv2.imread(path)
 
-def find_background(img: np.ndarray):
-    global bg_files
 
-    features = extract_features(img)
-    distances = []
-    for bg_feature in bg_features:
-        distance = np.linalg.norm(features - bg_feature)
-        distances.append(distance)
-    min_distance_index = np.argmin(distances)
-    bg = bg_files[min_distance_index]
+class BackgroundIndex:
+    """背景模板的特征索引
+
+    所有背景的缩略图特征保存在一个连续的 float32 矩阵中并预先计算平方范数，
+    最近背景的查找是一次矩阵向量乘法；完整的背景图只在匹配到时才读取。
+    """
+
+    def __init__(self, paths: list[Path], features: np.ndarray | None = None):
+        self.paths = [str(path) for path in paths]
+        if features is None:
+            features = np.empty(
+                (len(paths), THUMBNAIL_SIZE[0] * THUMBNAIL_SIZE[1] * 3), np.float32
+            )
+            for i, path in enumerate(self.paths):
+                features[i] = extract_features(cv2.imread(path))
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
+        self.norms = np.einsum("ij,ij->i", self.features, self.features)
+
+    @classmethod
+    def load(cls, directory: Path, cache_path: Path) -> "BackgroundIndex":
+        """读取背景模板的特征索引，模板没有变化时直接使用缓存文件"""
+        paths = sorted(directory.glob("*.png"))
+        fingerprint = background_fingerprint(paths)
+        try:
+            with np.load(cache_path) as cache:
+                if str(cache["fingerprint"]) == fingerprint:
+                    return cls(paths, cache["features"])
+        except (OSError, KeyError, ValueError):
+            pass
+
+        index = cls(paths)
+        index.save(cache_path, fingerprint)
+        logging.info("Computed features of %d backgrounds", len(index))
+        return index
+
+    def save(self, cache_path: Path, fingerprint: str):
+        # 先写临时文件再替换，多个工作进程同时启动时不会读到写了一半的文件
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                np.savez(f, fingerprint=fingerprint, features=self.features)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            logging.warning(
+                "Failed to save background features to %s: %s", cache_path, e
+            )
+
+    def __len__(self):
+        return len(self.paths)
+
+    def nearest(self, features: np.ndarray) -> tuple[int, float]:
+        """返回最接近的背景下标与距离，距离为每个像素通道的均方根差（0-255）"""
+        # ||a - b||² = ||a||² - 2a·b + ||b||²
+        squared = self.norms - 2 * (self.features @ features) + features @ features
+        index = int(np.argmin(squared))
+        return index, float(np.sqrt(max(squared[index], 0) / features.size))
+
+
+def background_fingerprint(paths: list[Path]) -> str:
+    """背景模板文件与特征参数的摘要，增删或修改任何一张模板都会使缓存失效"""
+    digest = hashlib.sha256(repr(THUMBNAIL_SIZE).encode())
+    for path in paths:
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def get_background_index() -> BackgroundIndex:
+    global _background_index
+    if _background_index is None:
+        with _load_lock:
+            if _background_index is None:
+                _background_index = BackgroundIndex.load(medium_imgs, background_cache)
+    return _background_index
+
+
+def load_models():
+    """预先加载 Siamese 模型与背景索引，避免在第一次识别时才加载"""
+    get_session()
+    get_background_index()
+
+
+def find_background(img: np.ndarray, max_distance: float | None = None):
+    """找到验证码使用的背景模板并返回与背景的差异图
+
+    与最接近的背景距离超过 max_distance 时认为是未收录的背景，直接放弃，
+    不再做后续的检测与匹配。
+    """
+    background_index = get_background_index()
+    if not len(background_index):
+        raise ValueError(f"{medium_imgs} 中没有背景模板")
+
+    index, distance = background_index.nearest(extract_features(img))
+    if max_distance is not None and distance > max_distance:
+        raise ValueError(f"未知的验证码背景，与最接近的背景距离为 {distance:.1f}")
+    bg = load_background(background_index.paths[index])
 
     # calculate the diff
     assert bg.shape == img.shape, f"bg shape error {bg.shape}, img shape {img.shape}"
@@ -104,9 +218,82 @@ def find_background(img: np.ndarray):
     return bg, diff
 
 
+GLYPH_POSITIONS = [165, 200, 231, 265]
+SIAMESE_INPUT_SIZE = (105, 105)
+
+
+@functools.cache
+def siamese_batched() -> bool:
+    """模型的 batch 维度为动态时，所有 (小图, 目标框) 组合可以一次推理完成"""
+    return not isinstance(get_session().get_inputs()[0].shape[0], int)
+
+
+def preprocess(images: list[np.ndarray]) -> np.ndarray:
+    """将一组 BGR 图片转换为 Siamese 模型输入的 NCHW float32 张量"""
+    batch = np.stack(
+        [
+            cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), SIAMESE_INPUT_SIZE)
+            for img in images
+        ]
+    ).astype(np.float32)
+    batch *= np.float32(1 / 255.0)
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+def similarity(glyphs: np.ndarray, crops: np.ndarray) -> np.ndarray:
+    """计算每个小图字符与每个目标框的相似度，返回 (字符数, 目标框数) 的矩阵"""
+    n_glyphs, n_crops = len(glyphs), len(crops)
+    # 第 i * n_crops + j 对为 (字符 i, 目标框 j)
+    inputs1 = np.tile(crops, (n_glyphs, 1, 1, 1))
+    inputs2 = np.repeat(glyphs, n_crops, axis=0)
+
+    session = get_session()
+    if siamese_batched():
+        logits = session.run(None, {"input": inputs1, "input.53": inputs2})[0]
+    else:
+        logits = np.concatenate(
+            [
+                session.run(
+                    None, {"input": inputs1[i : i + 1], "input.53": inputs2[i : i + 1]}
+                )[0]
+                for i in range(len(inputs1))
+            ]
+        )
+
+    scores = 1 / (1 + np.exp(-logits.reshape(-1)))
+    return scores.reshape(n_glyphs, n_crops)
+
+
+@functools.cache
+def _assignments(n_glyphs: int, n_crops: int) -> np.ndarray:
+    return np.array(list(itertools.permutations(range(n_crops), n_glyphs)))
+
+
+def assign(scores: np.ndarray) -> tuple[np.ndarray, float]:
+    """在相似度矩阵上求全局最优的一一匹配
+
+    每个字符匹配一个不同的目标框，使所有匹配的对数相似度之和最大（即联合概率最大）。
+    4 个字符、5 个目标框只有 120 种匹配方式，直接枚举即可得到精确解。
+
+    Returns:
+        (每个字符匹配到的目标框下标, 置信度)，置信度为匹配中最低的相似度
+    """
+    n_glyphs, n_crops = scores.shape
+    candidates = _assignments(n_glyphs, n_crops)
+    log_scores = np.log(np.clip(scores, 1e-12, 1.0))
+    totals = log_scores[np.arange(n_glyphs), candidates].sum(axis=1)
+    best = candidates[np.argmax(totals)]
+    confidence = float(scores[np.arange(n_glyphs), best].min())
+    return best, confidence
+
+
 class Crack:
     def __init__(self):
+        import ddddocr
+
         self.detect_model = ddddocr.DdddOcr(det=True, show_ad=False)
+        # 最近一次识别各阶段的耗时（秒）
+        self.timings: dict[str, float] = {}
 
     def read_base64_image(self, base64_string):
         img_data = base64.b64decode(base64_string)
@@ -116,14 +303,17 @@ class Crack:
         img = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
         return img
 
-    def detect(self, big_img, show=False):
+    def detect(self, big_img, show=False, max_background_distance=None):
         img = self.read_base64_image(big_img)
-        _, diff = find_background(img)
+        start = time.perf_counter()
+        _, diff = find_background(img, max_background_distance)
+        self.timings["find_background"] = time.perf_counter() - start
         self.big_img = img
 
-        out = self.detect_model.detection(
-            img_bytes=cv2.imencode(".png", diff)[1].tobytes()
-        )
+        start = time.perf_counter()
+        # 按位置传参，兼容 ddddocr 新版本中改名的参数
+        out = self.detect_model.detection(cv2.imencode(".png", diff)[1].tobytes())
+        self.timings["detection"] = time.perf_counter() - start
         r = [
             [int(box[0]), int(box[1]), int(box[2] - box[0]), int(box[3] - box[1])]
             for box in out
@@ -147,55 +337,43 @@ class Crack:
         return r
 
     def siamese(self, small_img, boxes, show=False):
-        positions = [165, 200, 231, 265]
-        result_list = []
-
-        big_img_copy = self.big_img.copy()
         small_imgs = self.read_base64_image(small_img)
 
-        for idx, x in enumerate(positions):
-            if len(result_list) == 4:
-                break
-            raw_image2 = small_imgs[11 : 11 + 28, x : x + 26]
-            img2 = cv2.cvtColor(raw_image2, cv2.COLOR_BGR2RGB)
-            img2 = cv2.resize(img2, (105, 105))
-            image_data_2 = np.array(img2) / 255.0
-            image_data_2 = np.transpose(image_data_2, (2, 0, 1))
-            image_data_2 = np.expand_dims(image_data_2, axis=0).astype(np.float32)
-            for box in boxes:
-                raw_image1 = self.big_img[
-                    box[1] : box[1] + box[3] + 2, box[0] : box[0] + box[2] + 2
-                ]
-                img1 = cv2.cvtColor(raw_image1, cv2.COLOR_BGR2RGB)
-                img1 = cv2.resize(img1, (105, 105))
-
-                image_data_1 = np.array(img1) / 255.0
-                image_data_1 = np.transpose(image_data_1, (2, 0, 1))
-                image_data_1 = np.expand_dims(image_data_1, axis=0).astype(np.float32)
-
-                inputs = {"input": image_data_1, "input.53": image_data_2}
-                output = session.run(None, inputs)
-                output_sigmoid = 1 / (1 + np.exp(-output[0]))
-                res = output_sigmoid[0][0]
-                if res >= 0.7:
-                    result_list.append([box[0], box[1]])
-                    cv2.rectangle(
-                        big_img_copy,
-                        (box[0], box[1]),
-                        (box[0] + box[2], box[1] + box[3]),
-                        (0, 255, 0),
-                        2,
-                    )
-                    cv2.putText(
-                        big_img_copy,
-                        str(idx),
-                        (box[0], box[1]),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.5,
-                        (0, 255, 0),
-                        1,
-                    )
-                    break
+        glyphs = preprocess(
+            [small_imgs[11 : 11 + 28, x : x + 26] for x in GLYPH_POSITIONS]
+        )
+        crops = preprocess(
+            [
+                self.big_img[box[1] : box[1] + box[3] + 2, box[0] : box[0] + box[2] + 2]
+                for box in boxes
+            ]
+        )
+        start = time.perf_counter()
+        scores = similarity(glyphs, crops)
+        self.timings["siamese"] = time.perf_counter() - start
+        matches, confidence = assign(scores)
+
+        result_list = []
+        big_img_copy = self.big_img.copy()
+        for idx, match in enumerate(matches):
+            box = boxes[match]
+            result_list.append([box[0], box[1]])
+            cv2.rectangle(
+                big_img_copy,
+                (box[0], box[1]),
+                (box[0] + box[2], box[1] + box[3]),
+                (0, 255, 0),
+                2,
+            )
+            cv2.putText(
+                big_img_copy,
+                f"{idx}:{scores[idx, match]:.2f}",
+                (box[0], box[1]),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                (0, 255, 0),
+                1,
+            )
 
         if show:
             concatenated = np.vstack((big_img_copy, small_imgs))
@@ -203,10 +381,17 @@ class Crack:
             cv2.waitKey(0)
             cv2.destroyAllWindows()
 
-        return result_list
+        return result_list, confidence
 
 
 if __name__ == "__main__":
+    import sys
+
+    # python -m icp_query.api.crack big.png small.png
+    big_path, small_path = sys.argv[1:3] if len(sys.argv) >= 3 else ("1.png", "2.png")
     crack = Crack()
-    boxes = crack.detect("./1.png")
-    print(crack.siamese("./2.png", boxes))
+    boxes = crack.detect(base64.b64encode(Path(big_path).read_bytes()).decode())
+    print(
+        crack.siamese(base64.b64encode(Path(small_path).read_bytes()).decode(), boxes)
+    )
+    print(crack.timings)
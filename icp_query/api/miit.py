@@ -1,75 +1,264 @@
-import base64
+import asyncio
 import hashlib
-import json
+import importlib.util
 import random
 import time
+from contextlib import asynccontextmanager
+from typing import Literal
 
 import httpx
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad
-from pydantic import BaseModel
 from verboselogs import VerboseLogger
 
-from .crack import Crack
+from ..metrics import UPSTREAM_REQUEST_SECONDS
+from ..tracing import span
+from .config import CrackConfig, UpstreamConfig
+from .models import Captcha, QueryPage, QueryResult  # noqa: F401  保留原有的导入路径
+from .ratelimit import AdaptiveLimiter, TokenBucket
+from .retry import CircuitBreaker, CircuitOpenError
+from .solver import CaptchaSolver
 
 
-class Captcha(BaseModel):
-    uuid: str
-    bigImage: str
-    smallImage: str
-    secretKey: str
-    wordCount: int
+class MiitError(ValueError):
+    """工信部接口返回失败"""
 
 
-class QueryResult(BaseModel):
-    contentTypeName: str
-    domain: str
-    domainId: int
-    leaderName: str
-    limitAccess: str
-    mainId: int
-    mainLicence: str
-    natureName: str
-    serviceId: int
-    serviceLicence: str
-    unitName: str
-    updateRecordTime: str
+class AuthError(MiitError):
+    """认证信息（sign/uuid）被接口拒绝"""
+
+
+class TokenExpiredError(MiitError):
+    """会话的 token 或 cookie 失效，需要重新获取"""
+
+
+class CaptchaError(MiitError):
+    """验证码识别失败或未通过校验"""
+
+
+class ThrottledError(MiitError):
+    """接口返回限流提示"""
+
+
+class AuthTimeoutError(MiitError):
+    """等待可用认证超时，通常是验证码持续求解失败"""
+
+
+AUTH_ERROR_KEYWORDS = ("sign", "uuid", "认证", "验证", "过期", "失效")
+THROTTLE_KEYWORDS = ("频繁", "繁忙", "限流", "too many", "busy")
+
+
+def is_token_error(d: dict) -> bool:
+    return d.get("code") == 401 or "token" in str(d.get("msg", "")).lower()
+
+
+def is_throttle_error(d: dict) -> bool:
+    msg = str(d.get("msg", "")).lower()
+    return d.get("code") == 429 or any(k in msg for k in THROTTLE_KEYWORDS)
+
+
+def raise_for_status(res: httpx.Response):
+    if res.status_code in (401, 403):
+        raise TokenExpiredError(f"session rejected: HTTP {res.status_code}")
+    res.raise_for_status()
+
+
+def raise_for_result(d: dict):
+    if d.get("success"):
+        return
+    msg = str(d.get("msg", ""))
+    if is_token_error(d):
+        raise TokenExpiredError(f"token rejected: {msg}")
+    if is_throttle_error(d):
+        raise ThrottledError(f"throttled: {msg}")
+    if any(k in msg.lower() for k in AUTH_ERROR_KEYWORDS):
+        raise AuthError(f"auth rejected: {msg}")
+    raise MiitError(f"query failed: {msg}")
+
+
+ErrorKind = Literal[
+    "auth_expired", "captcha_failed", "throttled", "network", "circuit_open", "other"
+]
+
+
+def classify(e: BaseException) -> ErrorKind:
+    """对上游错误分类，决定是否重试以及如何重试"""
+    if isinstance(e, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(e, (TokenExpiredError, AuthError)):
+        return "auth_expired"
+    if isinstance(e, CaptchaError):
+        return "captcha_failed"
+    if isinstance(e, httpx.TransportError):
+        return "network"
+    if isinstance(e, ThrottledError):
+        return "throttled"
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        return "throttled" if status == 429 or status >= 500 else "other"
+    return "other"
+
+
+def is_overload(e: BaseException) -> bool:
+    """网络错误、HTTP 429 与 5xx、限流提示视为上游过载；认证或 token 被拒、
+    验证码识别错误与其他 success: false（例如参数错误）与上游负载无关，不重试也不计入熔断"""
+    return classify(e) in ("throttled", "network")
+
+
+def has_h2() -> bool:
+    if importlib.util.find_spec("h2") is not None:
+        return True
+    MiitApi.looger.warning("h2 is not installed, falling back to HTTP/1.1")
+    return False
 
 
 class MiitApi(httpx.AsyncClient):
     looger = VerboseLogger("MiitApi")
     token: str
-
-    def __init__(self):
-        self.crack = Crack()
+    token_expires_at: float
+    token_refresh_at: float
+
+    def __init__(
+        self,
+        config: UpstreamConfig | None = None,
+        solver: CaptchaSolver | None = None,
+        global_limiter: TokenBucket | None = None,
+        concurrency: AdaptiveLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.config = config or UpstreamConfig()  # type: ignore
+        self.solver = solver or CaptchaSolver(CrackConfig(executor="inline"))
+        self.limiter = (
+            TokenBucket(self.config.rate_limit, self.config.burst)
+            if self.config.rate_limit is not None
+            else None
+        )
+        # 以下两个限制在多个会话之间共享，单独使用时按配置自行创建
+        if global_limiter is None and self.config.global_rate_limit is not None:
+            global_limiter = TokenBucket(
+                self.config.global_rate_limit, self.config.global_burst
+            )
+        self.global_limiter = global_limiter
+        if concurrency is None and self.config.adaptive.enabled:
+            concurrency = AdaptiveLimiter(self.config.adaptive)
+        self.concurrency = concurrency
+        self.breaker = breaker or CircuitBreaker(self.config.circuit_breaker)
+        # 每次刷新 cookie 与 token 后递增，用于合并并发的刷新请求
+        self.generation = 0
+        self.session_lock = asyncio.Lock()
+        http = self.config.http
         super().__init__(
+            http2=http.http2 and has_h2(),
+            limits=httpx.Limits(
+                max_connections=http.max_connections,
+                max_keepalive_connections=http.max_keepalive_connections,
+                keepalive_expiry=http.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=http.connect_timeout,
+                read=http.read_timeout,
+                write=http.write_timeout,
+                pool=http.pool_timeout,
+            ),
             headers={
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/101.0.4951.41 Safari/537.36 Edg/101.0.1210.32",
-                "Origin": "https://beian.miit.gov.cn",
-                "Referer": "https://beian.miit.gov.cn/",
+                "Origin": self.config.home_url.rstrip("/"),
+                "Referer": self.config.home_url,
             },
         )
 
+    async def throttle(self):
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        if self.global_limiter is not None:
+            await self.global_limiter.acquire()
+
+    @asynccontextmanager
+    async def upstream(self, endpoint: str):
+        """包裹一次上游请求：检查熔断、限速、占用并发名额，
+        并把结果反馈给熔断器、自适应并发控制与延迟指标"""
+        with span(f"miit.{endpoint}") as upstream_span:
+            self.breaker.before_call()
+            queued = time.monotonic()
+            start = None
+            overloaded = False
+            outcome = "ok"
+            try:
+                await self.throttle()
+                if self.concurrency is not None:
+                    await self.concurrency.acquire()
+                start = time.monotonic()
+                # 限速与等待并发名额的时间，区分排队与上游本身的延迟
+                upstream_span.set("upstream.wait_seconds", start - queued)
+                yield
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                outcome = "cancelled"
+                raise
+            except BaseException as e:
+                overloaded = is_overload(e)
+                self.breaker.record(overloaded)
+                outcome = classify(e)
+                raise
+            else:
+                self.breaker.record(False)
+            finally:
+                upstream_span.set("upstream.outcome", outcome)
+                if start is not None:
+                    latency = time.monotonic() - start
+                    UPSTREAM_REQUEST_SECONDS.labels(endpoint, outcome).observe(latency)
+                    if self.concurrency is not None:
+                        self.concurrency.release(latency, overloaded, endpoint)
+
     async def setup_cookie(self):
-        await self.get("https://beian.miit.gov.cn/")
+        async with self.upstream("home"):
+            await self.get(self.config.home_url)
         assert self.cookies.get("__jsluid_s", None) is not None
 
     async def __aenter__(self):
         await super().__aenter__()
-        await self.setup_cookie()
-        self.token = await self.get_token()
+        await self.refresh_session()
         return self
 
+    async def refresh_session(self, generation: int | None = None):
+        """重新获取 cookie 与 token
+
+        传入调用方看到的 generation 时，如果期间已经有其他请求完成了刷新，
+        则直接复用新的会话。
+        """
+        async with self.session_lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.cookies.clear()
+            await self.setup_cookie()
+            self.token = await self.get_token()
+            self.generation += 1
+            self.looger.info(
+                f"Session refreshed, token expires in "
+                f"{self.token_expires_at - time.monotonic():.0f}s"
+            )
+
     async def get_token(self):
         timeStamp = round(time.time() * 1000)
         authSecret = "testtest" + str(timeStamp)
         authKey = hashlib.md5(authSecret.encode(encoding="UTF-8")).hexdigest()
-        res = await self.post(
-            "https://hlwicpfwc.miit.gov.cn/icpproject_query/api/auth",
-            data={"authKey": authKey, "timeStamp": timeStamp},
+        async with self.upstream("auth"):
+            res = await self.post(
+                f"{self.config.api_url}/auth",
+                data={"authKey": authKey, "timeStamp": timeStamp},
+            )
+            raise_for_status(res)
+            t = res.json()
+            raise_for_result(t)
+
+        # expire 为 token 的有效期（毫秒），缺失时使用配置的默认值
+        expire = t["params"].get("expire")
+        ttl = expire / 1000 if expire and expire > 0 else self.config.token_ttl
+        now = time.monotonic()
+        self.token_expires_at = now + ttl
+        # 上游给出的有效期不超过 token_refresh_margin 时，至少等到有效期过半再刷新，
+        # 避免后台不停地刷新会话
+        self.token_refresh_at = now + max(
+            ttl * 0.5, ttl - self.config.token_refresh_margin
         )
-        res.raise_for_status()
-        t = res.json()
 
         return t["params"]["bussiness"]
 
@@ -90,77 +279,85 @@ class MiitApi(httpx.AsyncClient):
 
     async def solve_captcha(self) -> tuple[str, str]:
         client_uid = await self.get_client_uid()
-        res = await self.post(
-            "https://hlwicpfwc.miit.gov.cn/icpproject_query/api/image/getCheckImagePoint",
-            json={"clientUid": client_uid},
-            headers={
-                "Token": self.token,
-            },
-        )
-        res.raise_for_status()
+        async with self.upstream("get_captcha"):
+            res = await self.post(
+                f"{self.config.api_url}/image/getCheckImagePoint",
+                json={"clientUid": client_uid},
+                headers={
+                    "Token": self.token,
+                },
+            )
+            raise_for_status(res)
+            d = res.json()
+            raise_for_result(d)
+
+        captcha = Captcha.model_validate(d["params"])
+
+        try:
+            r = await self.generate_pointjson(
+                captcha.bigImage, captcha.smallImage, captcha.secretKey
+            )
+        except ValueError as e:
+            raise CaptchaError(f"captcha recognition failed: {e}") from e
+
+        async with self.upstream("check_captcha"):
+            res = await self.post(
+                f"{self.config.api_url}/image/checkImage",
+                json={
+                    "token": captcha.uuid,
+                    "secretKey": captcha.secretKey,
+                    "clientUid": client_uid,
+                    "pointJson": r,
+                },
+                headers={
+                    "Token": self.token,
+                },
+            )
+            raise_for_status(res)
+            d = res.json()
 
-        captcha = Captcha.model_validate(res.json()["params"])
-
-        r = self.generate_pointjson(
-            captcha.bigImage, captcha.smallImage, captcha.secretKey
-        )
-
-        res = await self.post(
-            "https://hlwicpfwc.miit.gov.cn/icpproject_query/api/image/checkImage",
-            json={
-                "token": captcha.uuid,
-                "secretKey": captcha.secretKey,
-                "clientUid": client_uid,
-                "pointJson": r,
-            },
-            headers={
-                "Token": self.token,
-            },
-        )
-
-        res.raise_for_status()
-
-        if not res.json()["success"]:
-            raise ValueError("captcha failed")
+        if not d["success"]:
+            if is_token_error(d):
+                raise TokenExpiredError(f"token rejected: {d.get('msg')}")
+            if is_throttle_error(d):
+                raise ThrottledError(f"throttled: {d.get('msg')}")
+            raise CaptchaError(f"captcha rejected: {d.get('msg')}")
 
-        return (captcha.uuid, res.json()["params"]["sign"])
+        return (captcha.uuid, d["params"]["sign"])
 
-    def generate_pointjson(self, big_img, small_img, secret_key: str):
-        boxes = self.crack.detect(big_img)
-        points = self.crack.siamese(small_img, boxes)
-        new_points = [[p[0] + 20, p[1] + 20] for p in points]
-        pointJson = [{"x": p[0], "y": p[1]} for p in new_points]
-        cipher = AES.new(secret_key.encode(), AES.MODE_ECB)
-        ciphertext = cipher.encrypt(
-            pad(json.dumps(pointJson, separators=(",", ":")).encode(), AES.block_size)
-        )
-        return base64.b64encode(ciphertext).decode()
+    async def generate_pointjson(self, big_img, small_img, secret_key: str):
+        return await self.solver.solve(big_img, small_img, secret_key)
 
     async def query(self, uuid: str, sign: str, domain: str, page=1):
+        return (await self.query_page(uuid, sign, domain, page)).results
+
+    async def query_page(self, uuid: str, sign: str, domain: str, page=1) -> QueryPage:
+        data = {
+            "pageNum": page,
+            "pageSize": self.config.page_size,
+            "unitName": domain,
+            "serviceType": 1,
+        }
         headers = {
             "Token": self.token,
             "Sign": sign,
             "Uuid": uuid,
         }
-
-        data = {"pageNum": page, "pageSize": 40, "unitName": domain, "serviceType": 1}
-        print(time.time(), "querying page", page)
-        resp = await self.post(
-            "https://hlwicpfwc.miit.gov.cn/icpproject_query/api/icpAbbreviateInfo/queryByCondition/",
-            headers=headers,
-            json=data,
-        )
-        print(time.time(), "page", page, "fetched")
-
-        resp.raise_for_status()
-        d = resp.json()
-
-        if not d["success"]:
-            print(d)
-            raise ValueError(f"query failed: {d['msg']}")
+        async with self.upstream("query"):
+            resp = await self.post(
+                f"{self.config.api_url}/icpAbbreviateInfo/queryByCondition/",
+                headers=headers,
+                json=data,
+            )
+            self.looger.debug(f"Fetched page {page} for {domain}")
+
+            raise_for_status(resp)
+            d = resp.json()
+
+            raise_for_result(d)
         if d["params"]["total"] == 0:
-            return []
-        return [QueryResult.model_validate(i) for i in d["params"]["list"]]
+            return QueryPage(pageNum=page, pageSize=self.config.page_size)
+        return QueryPage.model_validate(d["params"])
 
 
 if __name__ == "__main__":
@@ -174,8 +371,6 @@ if __name__ == "__main__":
             print(time.time(), "query finished")
             print(len(res))
 
-    import asyncio
-
     loop = asyncio.get_event_loop()
     loop.run_until_complete(main())
     loop.close()
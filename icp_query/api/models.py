@@ -0,0 +1,46 @@
+"""
+工信部接口的数据模型
+不依赖验证码识别模块，数据库模型与工具脚本可以直接导入而不加载识别模型
+"""
+
+import math
+
+from pydantic import BaseModel, Field
+
+
+class Captcha(BaseModel):
+    uuid: str
+    bigImage: str
+    smallImage: str
+    secretKey: str
+    wordCount: int
+
+
+class QueryResult(BaseModel):
+    contentTypeName: str
+    domain: str
+    domainId: int
+    leaderName: str
+    limitAccess: str
+    mainId: int
+    mainLicence: str
+    natureName: str
+    serviceId: int
+    serviceLicence: str
+    unitName: str
+    updateRecordTime: str
+
+
+class QueryPage(BaseModel):
+    """一页查询结果"""
+
+    pageNum: int = 1
+    pageSize: int = 0
+    total: int = 0
+    results: list[QueryResult] = Field(default_factory=list, alias="list")
+
+    @property
+    def pages(self) -> int:
+        if self.pageSize <= 0:
+            return 1
+        return max(math.ceil(self.total / self.pageSize), 1)
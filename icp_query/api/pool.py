@@ -0,0 +1,416 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+
+from pydantic import BaseModel, Field
+from verboselogs import VerboseLogger
+
+from ..metrics import AUTH_LEASE_AGE_SECONDS, CAPTCHA_SOLVES
+from ..tracing import span
+from .config import AuthPoolConfig, UpstreamConfig
+from .miit import AuthError, AuthTimeoutError, MiitApi, TokenExpiredError, classify
+from .models import QueryPage, QueryResult
+from .ratelimit import AdaptiveLimiter, TokenBucket
+from .retry import CircuitBreaker, CircuitOpenError, RetryBudget, backoff
+from .solver import CaptchaSolver
+
+
+class AuthLease(BaseModel):
+    """池中的一份认证信息及其使用情况"""
+
+    uuid: str
+    sign: str
+    created_at: float = Field(default_factory=time.monotonic)
+    uses: int = 0
+    last_error: str | None = None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+
+class AuthPool(MiitApi):
+    """验证码认证池
+
+    后台任务将池中的认证数量维持在 low_watermark 与 high_watermark 之间，
+    并发求解验证码。每份认证以租约的形式借出，超过有效期、达到使用次数上限
+    或被接口拒绝的认证会被淘汰。会话的 cookie 与 token 在过期前或被接口拒绝时
+    自动刷新，池中的认证保留不变。
+    """
+
+    pool: deque[AuthLease]
+    leased: dict[str, AuthLease]
+    logger = VerboseLogger("AuthPool")
+
+    def __init__(
+        self,
+        config: AuthPoolConfig,
+        upstream: UpstreamConfig | None = None,
+        solver: CaptchaSolver | None = None,
+        global_limiter: TokenBucket | None = None,
+        concurrency: AdaptiveLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+        retry_budget: RetryBudget | None = None,
+    ):
+        super().__init__(upstream, solver, global_limiter, concurrency, breaker)
+        self.retry_budget = retry_budget or RetryBudget(self.config.retry)
+        self.auth_config = config
+        self.inflight = 0
+        self.pool = deque()
+        self.leased = {}
+        self.cond = asyncio.Condition()
+        self.solving = 0
+        self.waiters = 0
+        self.filling = False
+        self.tasks: list[asyncio.Task] = []
+        self.wakeups: set[asyncio.Task] = set()
+        self.breaker.on_open(self._wake_waiters)
+
+    def _wake_waiters(self):
+        # 熔断后认证池无法补充，唤醒等待认证的请求，让它们尽快失败
+        task = asyncio.create_task(self._notify_all())
+        self.wakeups.add(task)
+        task.add_done_callback(self.wakeups.discard)
+
+    async def _notify_all(self):
+        async with self.cond:
+            self.cond.notify_all()
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        self.tasks = [
+            asyncio.create_task(self._refill_worker())
+            for _ in range(self.auth_config.concurrency)
+        ]
+        self.tasks.append(asyncio.create_task(self._expire_worker()))
+        self.tasks.append(asyncio.create_task(self._session_worker()))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        return await super().__aexit__(*exc_info)
+
+    def _is_retired(self, lease: AuthLease) -> bool:
+        if lease.age >= self.auth_config.ttl:
+            return True
+        return (
+            self.auth_config.max_uses is not None
+            and lease.uses >= self.auth_config.max_uses
+        )
+
+    def _evict_retired(self):
+        if any(self._is_retired(lease) for lease in self.pool):
+            self.pool = deque(
+                lease for lease in self.pool if not self._is_retired(lease)
+            )
+
+    def _has_auth(self) -> bool:
+        self._evict_retired()
+        return bool(self.pool)
+
+    def _wants_more(self) -> bool:
+        supply = len(self.pool) + self.solving
+        if supply < self.auth_config.low_watermark:
+            self.filling = True
+        elif supply >= self.auth_config.high_watermark:
+            self.filling = False
+        # 等待中的请求优先共享正在求解的验证码与即将归还的租约，
+        # 只有超出这部分的等待者才需要额外求解
+        return self.filling or supply + len(self.leased) < self.waiters
+
+    def _backoff(self, failures: int) -> float:
+        return backoff(
+            failures - 1, self.auth_config.retry_interval, self.config.retry.max_delay
+        )
+
+    async def _refill_worker(self):
+        failures = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(self._wants_more)
+                self.solving += 1
+
+            generation = self.generation
+            delay = None
+            try:
+                # 后台求解不属于任何请求，每次求解是一条独立的链路
+                with span("auth_pool.solve_captcha"):
+                    uuid, sign = await self.solve_captcha()
+                lease = AuthLease(uuid=uuid, sign=sign)
+                CAPTCHA_SOLVES.labels("success").inc()
+            except TokenExpiredError as e:
+                lease = None
+                CAPTCHA_SOLVES.labels(classify(e)).inc()
+                self.logger.warning(f"Session expired while solving captcha: {e}")
+                await self._try_refresh(generation)
+            except CircuitOpenError as e:
+                lease = None
+                delay = e.retry_after
+            except Exception as e:
+                lease = None
+                CAPTCHA_SOLVES.labels(classify(e)).inc()
+                self.logger.warning(f"Failed to get auth ({classify(e)}): {e}")
+
+            async with self.cond:
+                self.solving -= 1
+                if lease is not None:
+                    self.pool.append(lease)
+                self.cond.notify_all()
+
+            if lease is not None:
+                failures = 0
+                continue
+            # 连续失败时指数退避，熔断期间等到可以探测时再试
+            failures += 1
+            if delay is None:
+                delay = self._backoff(failures)
+            await asyncio.sleep(delay)
+
+    async def _expire_worker(self):
+        while True:
+            async with self.cond:
+                self._evict_retired()
+                self.cond.notify_all()
+                oldest = min((lease.created_at for lease in self.pool), default=None)
+
+            delay = self.auth_config.ttl
+            if oldest is not None:
+                delay = oldest + self.auth_config.ttl - time.monotonic()
+            await asyncio.sleep(max(delay, 0.1))
+
+    async def _session_worker(self):
+        failures = 0
+        while True:
+            await asyncio.sleep(max(self.token_refresh_at - time.monotonic(), 0))
+            if await self._try_refresh():
+                failures = 0
+            else:
+                failures += 1
+                await asyncio.sleep(self._backoff(failures))
+
+    async def _try_refresh(self, generation: int | None = None) -> bool:
+        try:
+            await self.refresh_session(generation)
+            return True
+        except Exception as e:
+            self.logger.warning(f"Failed to refresh session: {e}")
+            return False
+
+    async def acquire(self) -> AuthLease:
+        with span("auth_pool.acquire") as acquire_span:
+            async with self.cond:
+                acquire_span.set("auth_pool.available", len(self.pool))
+                self.waiters += 1
+                try:
+                    self.cond.notify_all()
+                    await self._wait_for_auth()
+                finally:
+                    self.waiters -= 1
+                lease = self.pool.popleft()
+                lease.uses += 1
+                AUTH_LEASE_AGE_SECONDS.observe(lease.age)
+                acquire_span.set("auth.age_seconds", lease.age)
+                acquire_span.set("auth.uses", lease.uses)
+                self.leased[lease.uuid] = lease
+                # 取走后池可能低于水位，唤醒补充任务
+                self.cond.notify_all()
+                return lease
+
+    async def _wait_for_auth(self):
+        """在持有 cond 时等待可用认证；熔断器打开或超过 acquire_timeout 时抛出异常"""
+        timeout = self.auth_config.acquire_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._has_auth():
+            if self.breaker.is_open:
+                raise CircuitOpenError(self.breaker.retry_after)
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise AuthTimeoutError(f"no auth available after {timeout:.0f}s")
+            try:
+                await asyncio.wait_for(self.cond.wait(), remaining)
+            except TimeoutError:
+                pass
+
+    async def release(self, lease: AuthLease, error: Exception | None = None):
+        """归还租约；认证被接口拒绝时直接淘汰，其他错误（包括 token 失效）只记录下来"""
+        async with self.cond:
+            self.leased.pop(lease.uuid, None)
+            # 等待中的请求把借出的租约算作供给，淘汰时也要唤醒补充任务
+            self.cond.notify_all()
+            if error is not None:
+                lease.last_error = f"{type(error).__name__}: {error}"
+            if isinstance(error, AuthError):
+                self.logger.info(
+                    f"Retiring auth {lease.uuid} after {lease.uses} uses: {error}"
+                )
+                return
+            if self._is_retired(lease):
+                return
+            self.pool.append(lease)
+
+    async def retire(self, lease: AuthLease):
+        """淘汰租约，不再放回池中"""
+        async with self.cond:
+            self.leased.pop(lease.uuid, None)
+            self.cond.notify_all()
+
+    async def _query_with_lease(self, name: str, page: int) -> QueryPage:
+        lease = await self.acquire()
+        try:
+            res = await self.query_page(lease.uuid, lease.sign, name, page)
+        except Exception as e:
+            await self.release(lease, e)
+            raise
+        await self.release(lease)
+        return res
+
+    async def lookup(self, name: str, page=1) -> list[QueryResult]:
+        return (await self.lookup_page(name, page)).results
+
+    async def lookup_page(self, name: str, page=1) -> QueryPage:
+        self.inflight += 1
+        try:
+            with span("auth_pool.lookup", **{"query.name": name, "query.page": page}):
+                return await self._lookup_with_retry(name, page)
+        finally:
+            self.inflight -= 1
+
+    async def _lookup_with_retry(self, name: str, page: int) -> QueryPage:
+        """按错误类型重试：token 失效时刷新会话，认证被拒时换一份认证，
+        限流与网络错误指数退避；重试次数受 max_attempts 与重试预算限制"""
+        retry = self.config.retry
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            generation = self.generation
+            try:
+                return await self._query_with_lease(name, page)
+            except Exception as e:
+                kind = classify(e)
+                attempt += 1
+                if (
+                    kind not in ("auth_expired", "throttled", "network")
+                    or attempt >= retry.max_attempts
+                    or not self.retry_budget.withdraw()
+                ):
+                    raise
+                self.logger.info(
+                    f"Retrying {name} page {page} after {kind} error "
+                    f"({attempt}/{retry.max_attempts - 1}): {e}"
+                )
+                if isinstance(e, TokenExpiredError):
+                    await self.refresh_session(generation)
+                elif kind != "auth_expired":
+                    await asyncio.sleep(
+                        backoff(attempt - 1, retry.base_delay, retry.max_delay)
+                    )
+
+
+class SessionPool:
+    """多个独立上游会话组成的池
+
+    每个会话（AuthPool）拥有各自的 cookie、token、连接池、认证池与限速器，
+    查询按最少负载分配到各个会话上。全局限速与自适应并发控制由所有会话共享。
+    """
+
+    sessions: list[AuthPool]
+    logger = VerboseLogger("SessionPool")
+
+    def __init__(
+        self,
+        config: UpstreamConfig,
+        auth_config: AuthPoolConfig,
+        solver: CaptchaSolver | None = None,
+    ):
+        self.config = config
+        self.global_limiter = (
+            TokenBucket(config.global_rate_limit, config.global_burst)
+            if config.global_rate_limit is not None
+            else None
+        )
+        self.concurrency = (
+            AdaptiveLimiter(config.adaptive) if config.adaptive.enabled else None
+        )
+        self.breaker = CircuitBreaker(config.circuit_breaker)
+        self.retry_budget = RetryBudget(config.retry)
+        self.sessions = [
+            AuthPool(
+                auth_config,
+                config,
+                solver,
+                self.global_limiter,
+                self.concurrency,
+                self.breaker,
+                self.retry_budget,
+            )
+            for _ in range(config.sessions)
+        ]
+        self.stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        await self.stack.__aenter__()
+        for session in self.sessions:
+            await self.stack.enter_async_context(session)
+        self.logger.info(f"Started {len(self.sessions)} upstream sessions")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.stack.__aexit__(*exc_info)
+
+    @property
+    def circuit_open(self) -> bool:
+        """上游熔断中，此时应尽量使用缓存（包括过期记录）应答"""
+        return self.breaker.is_open
+
+    def pick(self) -> AuthPool:
+        """选出进行中请求最少的会话，负载相同时优先限速等待最短的"""
+
+        def load(session: AuthPool):
+            delay = session.limiter.delay() if session.limiter is not None else 0.0
+            return session.inflight, delay
+
+        return min(self.sessions, key=load)
+
+    def check_circuit(self):
+        # 熔断期间认证池无法补充，直接失败而不是等待认证
+        if self.breaker.is_open:
+            raise CircuitOpenError(self.breaker.retry_after)
+
+    async def lookup(self, name: str, page=1) -> list[QueryResult]:
+        self.check_circuit()
+        return await self.pick().lookup(name, page)
+
+    async def lookup_page(self, name: str, page=1) -> QueryPage:
+        self.check_circuit()
+        return await self.pick().lookup_page(name, page)
+
+    async def lookup_all(self, name: str) -> list[QueryResult]:
+        """获取全部分页结果，第一页之后的各页分配到各个会话上，
+        同时进行的页数不超过 page_concurrency"""
+        first = await self.lookup_page(name)
+        pages = first.pages
+        if self.config.max_pages is not None:
+            pages = min(pages, self.config.max_pages)
+
+        semaphore = asyncio.Semaphore(self.config.page_concurrency)
+
+        async def fetch(page: int) -> QueryPage:
+            async with semaphore:
+                return await self.lookup_page(name, page)
+
+        rest = await asyncio.gather(*(fetch(page) for page in range(2, pages + 1)))
+        results: dict[str, QueryResult] = {}
+        for res in (first, *rest):
+            for result in res.results:
+                # 翻页期间数据变动可能导致相邻两页出现重复记录
+                results.setdefault(result.domain, result)
+        if pages < first.pages:
+            self.logger.info(
+                f"Fetched {pages} of {first.pages} pages ({first.total} records) "
+                f"for {name}"
+            )
+        return list(results.values())
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from verboselogs import VerboseLogger
+
+from .config import AdaptiveConcurrencyConfig
+
+
+class TokenBucket:
+    """令牌桶限速器
+
+    以 rate 个/秒的速度补充令牌，最多积累 burst 个。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.waiting = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """新请求拿到令牌前预计需要等待的秒数（已在排队的请求优先）"""
+        self._refill()
+        return max(self.waiting + 1 - self.tokens, 0) / self.rate
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        self.tokens -= 1
+
+
+class AdaptiveLimiter:
+    """AIMD 自适应并发限制
+
+    每个成功且延迟正常的请求使上限增加 increase / limit（即每个往返周期约增加
+    increase），上游过载或延迟超过基线 latency_factor 倍时上限乘以 decrease。
+    基线按端点分别计算（首页、验证码与查询的延迟相差很大），为延迟的指数平滑平均；
+    突增的样本以很小的权重计入基线，上游延迟整体上升后基线仍能逐渐跟上，
+    不会让上限一直收缩到 min_limit。
+    """
+
+    logger = VerboseLogger("AdaptiveLimiter")
+
+    def __init__(self, config: AdaptiveConcurrencyConfig):
+        self.config = config
+        self.limit = float(config.initial)
+        self.inflight = 0
+        self.latency: dict[str, float] = {}
+        self.decreased_at = 0.0
+        self.released = asyncio.Event()
+
+    async def acquire(self):
+        while self.inflight >= int(self.limit):
+            self.released.clear()
+            await self.released.wait()
+        self.inflight += 1
+
+    def release(self, latency: float, overloaded: bool = False, endpoint: str = ""):
+        self.inflight -= 1
+        baseline = self.latency.get(endpoint)
+        spike = baseline is not None and latency > baseline * self.config.latency_factor
+        if baseline is None:
+            self.latency[endpoint] = latency
+        elif not overloaded:
+            weight = 0.01 if spike else 0.1
+            self.latency[endpoint] = (1 - weight) * baseline + weight * latency
+        if overloaded or spike:
+            self._decrease("upstream overloaded" if overloaded else "latency spike")
+        else:
+            self.limit = min(
+                self.config.max_limit, self.limit + self.config.increase / self.limit
+            )
+        self.released.set()
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self.decreased_at < self.config.cooldown:
+            return
+        self.decreased_at = now
+        limit = max(self.config.min_limit, self.limit * self.config.decrease)
+        if int(limit) < int(self.limit):
+            self.logger.info(
+                f"Concurrency limit {int(self.limit)} -> {int(limit)}: {reason}"
+            )
+        self.limit = limit
@@ -0,0 +1,117 @@
+import random
+import time
+from collections.abc import Callable
+from typing import Literal
+
+from verboselogs import VerboseLogger
+
+from .config import CircuitBreakerConfig, RetryConfig
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间拒绝访问上游"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"upstream circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def backoff(attempt: int, base: float, max_delay: float) -> float:
+    """第 attempt 次重试前的等待时间：指数退避加 full jitter"""
+    return random.uniform(0, min(max_delay, base * 2**attempt))
+
+
+class RetryBudget:
+    """重试预算
+
+    每次首次调用存入 ratio 个令牌，每次重试消耗一个，最多积累 max_tokens 个。
+    上游大面积失败时重试次数被限制在正常请求量的 ratio 倍以内，避免重试放大流量。
+    """
+
+    def __init__(self, config: RetryConfig):
+        self.config = config
+        self.tokens = float(config.budget_max)
+
+    def deposit(self):
+        self.tokens = min(
+            self.config.budget_max, self.tokens + self.config.budget_ratio
+        )
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """上游熔断器
+
+    连续 failure_threshold 次上游失败（网络错误或限流）后打开，reset_timeout
+    秒内所有请求直接失败；之后进入半开状态，放行少量探测请求，成功则关闭，
+    失败则重新打开。
+    """
+
+    logger = VerboseLogger("CircuitBreaker")
+
+    def __init__(self, config: CircuitBreakerConfig):
+        self.config = config
+        self.state: Literal["closed", "open", "half_open"] = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.listeners: list[Callable[[], None]] = []
+
+    def on_open(self, listener: Callable[[], None]):
+        """注册熔断器打开时的回调"""
+        self.listeners.append(listener)
+
+    @property
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.config.reset_timeout - time.monotonic(), 0)
+
+    @property
+    def is_open(self) -> bool:
+        """熔断器打开且尚未到探测时间"""
+        return self.state == "open" and self.retry_after > 0
+
+    def before_call(self):
+        if not self.config.enabled:
+            return
+        if self.state == "open":
+            if self.retry_after > 0:
+                raise CircuitOpenError(self.retry_after)
+            self.state = "half_open"
+            self.probes = 0
+            self.logger.info("Circuit half-open, probing upstream")
+        if self.state == "half_open":
+            if self.probes >= self.config.half_open_max_calls:
+                raise CircuitOpenError(self.config.reset_timeout)
+            self.probes += 1
+
+    def abandon(self):
+        """放行的请求被取消，没有结果，归还半开状态的探测名额"""
+        if self.state == "half_open" and self.probes > 0:
+            self.probes -= 1
+
+    def record(self, failed: bool):
+        if not self.config.enabled:
+            return
+        if not failed:
+            if self.state != "closed":
+                self.logger.info("Circuit closed, upstream recovered")
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.config.failure_threshold:
+            opened = self.state != "open"
+            if opened:
+                self.logger.warning(
+                    f"Circuit opened after {self.failures} upstream failures"
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            if opened:
+                for listener in self.listeners:
+                    listener()
@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import importlib.util
+import json
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from verboselogs import VerboseLogger
+
+from ..metrics import CRACK_STAGE_SECONDS
+from ..tracing import span
+from .config import CrackConfig
+from .crack import Crack, load_models
+
+_local = threading.local()
+
+
+def init_worker():
+    """在工作线程/进程启动时加载识别模型，每个工作者只加载一次"""
+    _local.crack = Crack()
+    load_models()
+
+
+def get_crack() -> Crack:
+    # Crack 在 detect 与 siamese 之间保存了状态，不能跨线程共享
+    crack = getattr(_local, "crack", None)
+    if crack is None:
+        crack = _local.crack = Crack()
+    return crack
+
+
+@contextmanager
+def profiled(path: Path):
+    """用 pyinstrument 采样分析器记录一段代码，结束后保存 HTML 报告"""
+    from pyinstrument import Profiler
+
+    profiler = Profiler(async_mode="disabled")
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(profiler.output_html(), encoding="utf-8")
+
+
+def generate_pointjson(
+    big_img: str,
+    small_img: str,
+    secret_key: str,
+    min_confidence: float = 0.0,
+    max_background_distance: float | None = None,
+    profile_path: str | None = None,
+) -> tuple[str, dict[str, float]]:
+    """识别验证码并加密坐标，同时返回各阶段耗时
+
+    耗时随结果一起返回，进程池中运行时也能在主进程记录指标。
+    传入 profile_path 时对本次识别进行采样分析并把报告保存到该路径。
+    """
+    with profiled(Path(profile_path)) if profile_path is not None else nullcontext():
+        crack = get_crack()
+        crack.timings.clear()
+        boxes = crack.detect(big_img, max_background_distance=max_background_distance)
+        points, confidence = crack.siamese(small_img, boxes)
+        if confidence < min_confidence:
+            raise ValueError(f"验证码识别置信度过低: {confidence:.3f}")
+        new_points = [[p[0] + 20, p[1] + 20] for p in points]
+        pointJson = [{"x": p[0], "y": p[1]} for p in new_points]
+        cipher = AES.new(secret_key.encode(), AES.MODE_ECB)
+        ciphertext = cipher.encrypt(
+            pad(json.dumps(pointJson, separators=(",", ":")).encode(), AES.block_size)
+        )
+        return base64.b64encode(ciphertext).decode(), dict(crack.timings)
+
+
+class CaptchaSolver:
+    """在事件循环之外运行验证码识别流水线"""
+
+    logger = VerboseLogger("CaptchaSolver")
+    executor: Executor | None
+
+    def __init__(self, config: CrackConfig | None = None):
+        self.config = config or CrackConfig()  # type: ignore
+        workers = self.config.workers
+
+        if self.config.executor == "thread":
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="crack",
+                initializer=init_worker,
+            )
+        elif self.config.executor == "process":
+            # fork 会继承 onnxruntime 的线程状态，因此使用 spawn 启动工作进程
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+            )
+        else:
+            self.executor = None
+
+        self.profile_rate = self.config.profile_rate
+        if self.profile_rate > 0 and importlib.util.find_spec("pyinstrument") is None:
+            self.logger.warning("pyinstrument is not installed, profiling disabled")
+            self.profile_rate = 0
+
+        self.logger.info(
+            "Captcha solver started: executor=%s, workers=%s",
+            self.config.executor,
+            workers if self.executor is not None else 0,
+        )
+
+    async def solve(self, big_img: str, small_img: str, secret_key: str) -> str:
+        with span(
+            "crack.generate_pointjson", **{"crack.executor": self.config.executor}
+        ) as crack_span:
+            profile_path = None
+            if self.profile_rate > 0 and random.random() < self.profile_rate:
+                profile_path = str(
+                    Path(self.config.profile_dir) / f"crack-{time.time_ns()}.html"
+                )
+                crack_span.set("crack.profile", profile_path)
+            args = (
+                big_img,
+                small_img,
+                secret_key,
+                self.config.min_confidence,
+                self.config.max_background_distance,
+                profile_path,
+            )
+            start = time.perf_counter()
+            if self.executor is None:
+                pointjson, timings = generate_pointjson(*args)
+            else:
+                loop = asyncio.get_running_loop()
+                pointjson, timings = await loop.run_in_executor(
+                    self.executor, generate_pointjson, *args
+                )
+            for stage, seconds in timings.items():
+                CRACK_STAGE_SECONDS.labels(stage).observe(seconds)
+                crack_span.set(f"crack.{stage}_seconds", seconds)
+            # total 包含在线程池/进程池中排队的时间
+            CRACK_STAGE_SECONDS.labels("total").observe(time.perf_counter() - start)
+            return pointjson
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
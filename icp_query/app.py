@@ -1,104 +1,481 @@
 import asyncio
+import codecs
+import logging
+import math
+from collections.abc import AsyncIterable, AsyncIterator, Callable
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Optional, TypeVar
 
-import verboselogs
-from fastapi import Depends, FastAPI, HTTPException
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
 
-from .api.miit import MiitApi
+from . import metrics
+from .api.miit import AuthTimeoutError, MiitError
+from .api.pool import SessionPool
+from .api.retry import CircuitOpenError
+from .api.solver import CaptchaSolver
 from .config import load_config
-from .dao.query import QueryResponse
+from .dao.query import (
+    BatchQueryItem,
+    BatchQueryRequest,
+    BatchQueryResponse,
+    QueryListResponse,
+    QueryResponse,
+    StreamQueryItem,
+)
+from .db.cache import RecordCache
 from .db.db import IcpRecord, get_engine, init_db
+from .db.lookup import LookupKey, lookup_key, match_record
 from .db.query import Query
+from .metrics import CACHE_LOOKUPS, RecordCacheCollector, SessionPoolCollector
+from .refresher import Refresher
+from .singleflight import SingleFlight
+from .tracing import TracingMiddleware, tracer
 
-cm = load_config()
-
-
-class AuthPool(MiitApi):
-    pool: set[tuple[str, str]]
-    lock: asyncio.Lock
-    logger = verboselogs.VerboseLogger("AuthPool")
+logger = logging.getLogger(__name__)
 
-    def __init__(self):
-        super().__init__()
-        self.pool = set()
-        self.lock = asyncio.Lock()
+T = TypeVar("T")
 
-    async def get_auth(self):
-        async with self.lock:
-            if not self.pool:
-                while True:
-                    try:
-                        uuid, auth = await self.solve_captcha()
-                        self.pool.add((uuid, auth))
-                        break
-                    except Exception as e:
-                        self.logger.warning(f"Failed to get auth: {e}")
-                        await asyncio.sleep(1)
-            # get one auth from pool
-            return self.pool.pop()
-
-    async def return_auth(self, uuid: str, auth: str):
-        async with self.lock:
-            self.pool.add((uuid, auth))
+cm = load_config()
+tracer.configure(cm.tracing)
 
 
-auth_pool: Optional["AuthPool"] = None
+session_pool: Optional["SessionPool"] = None
+record_cache = RecordCache(cm.cache)
+# 同一查询条件的并发未命中只发起一次上游查询并只写入一次
+inflight_lookups: SingleFlight[IcpRecord | None] = SingleFlight()
+inflight_lists: SingleFlight[list[IcpRecord]] = SingleFlight()
+# 过期记录的后台刷新，并发与排队数量有上限
+refresher = Refresher(cm.cache)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global auth_pool
-    auth_pool = AuthPool()
+    global session_pool
 
     await init_db(cm.database)
 
-    async with auth_pool:
-        yield
+    async with tracer:
+        with CaptchaSolver(cm.crack) as solver:
+            session_pool = SessionPool(cm.upstream, cm.auth_pool, solver)
+            collectors = (
+                SessionPoolCollector(session_pool),
+                RecordCacheCollector(record_cache),
+            )
+            metrics.register(*collectors)
+            try:
+                async with session_pool, refresher:
+                    yield
+            finally:
+                metrics.unregister(*collectors)
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(TracingMiddleware)
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, e: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "upstream unavailable"},
+        headers={"Retry-After": str(math.ceil(e.retry_after))},
+    )
+
+
+@app.exception_handler(AuthTimeoutError)
+async def auth_timeout_handler(request: Request, e: AuthTimeoutError):
+    logger.warning(f"Auth pool exhausted on {request.url.path}: {e}")
+    return JSONResponse(status_code=503, content={"detail": "upstream unavailable"})
 
 
-async def auth_pool_dep():
-    if auth_pool is None:
-        raise RuntimeError("Auth pool has not been started")
-    return auth_pool
+@app.exception_handler(MiitError)
+@app.exception_handler(httpx.HTTPError)
+async def upstream_error_handler(request: Request, e: Exception):
+    logger.warning(f"Upstream error on {request.url.path}: {e}")
+    return JSONResponse(status_code=502, content={"detail": "upstream error"})
 
 
-AuthPoolDep = Depends(auth_pool_dep)
+async def session_pool_dep():
+    if session_pool is None:
+        raise RuntimeError("Session pool has not been started")
+    return session_pool
+
+
+SessionPoolDep = Depends(session_pool_dep)
 
 
 async def query_dep():
-    return Query(get_engine())
+    return Query(get_engine(), record_cache, cm.database.batch_size)
 
 
 QueryDep = Depends(query_dep)
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/solve_captcha")
-async def solve_captcha(auth_pool: AuthPool = AuthPoolDep):
-    uuid, auth = await auth_pool.get_auth()
-    return {"uuid": uuid, "auth": auth}
+async def solve_captcha(session_pool: SessionPool = SessionPoolDep):
+    session_pool.check_circuit()
+    auth_pool = session_pool.pick()
+    lease = await auth_pool.acquire()
+    # 认证交给调用方使用，不再放回池中
+    await auth_pool.retire(lease)
+    return {"uuid": lease.uuid, "auth": lease.sign}
 
 
 @app.get("/query", response_model=QueryResponse)
 async def query_icp(
-    name: str, auth_pool: AuthPool = AuthPoolDep, query: Query = QueryDep
+    name: str,
+    session_pool: SessionPool = SessionPoolDep,
+    query: Query = QueryDep,
+):
+    # 规范化后等价的输入共享同一条缓存
+    key = lookup_key(name)
+    response = await resolve_record(key, await query.get(key), session_pool, query)
+    if response is None:
+        raise HTTPException(404, "not found")
+    return response
+
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_icp_batch(
+    request: BatchQueryRequest,
+    session_pool: SessionPool = SessionPoolDep,
+    query: Query = QueryDep,
+):
+    """批量查询：缓存命中一次性从数据库取出，未命中的并发查询上游"""
+    if len(request.names) > cm.batch.max_names:
+        raise HTTPException(
+            422, f"too many names: {len(request.names)} > {cm.batch.max_names}"
+        )
+
+    keys = [lookup_key(name) for name in request.names]
+    cached = await query.get_many(keys)
+    semaphore = asyncio.Semaphore(cm.batch.concurrency)
+
+    async def resolve(name: str, key: LookupKey) -> BatchQueryItem:
+        async with semaphore:
+            try:
+                response = await resolve_record(
+                    key, cached.get(key), session_pool, query
+                )
+            except Exception as e:
+                logger.warning(f"Batch lookup of {key.value} failed: {e}")
+                return BatchQueryItem(name=name, status="error", error=str(e))
+        if response is None:
+            return BatchQueryItem(name=name, status="not_found")
+        return BatchQueryItem(name=name, status="ok", **response.model_dump())
+
+    results = await asyncio.gather(
+        *(resolve(name, key) for name, key in zip(request.names, keys))
+    )
+    return BatchQueryResponse(results=results)
+
+
+@app.post("/query/stream")
+async def query_icp_stream(
+    request: Request,
+    session_pool: SessionPool = SessionPoolDep,
+    query: Query = QueryDep,
+):
+    """流式批量查询
+
+    请求体每行一个名称，响应为 NDJSON，每完成一项输出一行。缓存命中立即输出，
+    上游查询完成后输出，顺序与请求不同，按 index 对应。只有在客户端读取了结果、
+    进行中的上游查询少于 batch.concurrency 时才继续读取请求体，内存占用与输入规模无关。
+    """
+
+    async def resolve(
+        index: int, name: str, key: LookupKey, cached: IcpRecord | None
+    ) -> StreamQueryItem:
+        try:
+            response = await resolve_record(key, cached, session_pool, query)
+        except Exception as e:
+            logger.warning(f"Stream lookup of {key.value} failed: {e}")
+            return StreamQueryItem(index=index, name=name, status="error", error=str(e))
+        if response is None:
+            return StreamQueryItem(index=index, name=name, status="not_found")
+        return StreamQueryItem(
+            index=index, name=name, status="ok", **response.model_dump()
+        )
+
+    async def results(body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+        pending: set[asyncio.Task[StreamQueryItem]] = set()
+
+        async def drain(limit: int) -> AsyncIterator[str]:
+            nonlocal pending
+            while len(pending) > limit:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result().model_dump_json() + "\n"
+
+        offset = 0
+        try:
+            chunks = batched(iter_lines(body), cm.batch.stream_chunk_size)
+            async for names in chunks:
+                keys = [lookup_key(name) for name in names]
+                cached = await query.get_many(keys)
+                for index, (name, key) in enumerate(zip(names, keys), offset):
+                    record = cached.get(key)
+                    if record is not None and (
+                        not is_stale(record) or cm.cache.stale_while_revalidate
+                    ):
+                        # 不需要等待上游，直接输出
+                        item = await resolve(index, name, key, record)
+                        yield item.model_dump_json() + "\n"
+                        continue
+                    pending.add(asyncio.create_task(resolve(index, name, key, record)))
+                    async for line in drain(cm.batch.concurrency - 1):
+                        yield line
+                offset += len(names)
+            async for line in drain(0):
+                yield line
+        finally:
+            # 客户端断开时取消尚未完成的查询
+            for task in pending:
+                task.cancel()
+
+    return RequestStreamingResponse(request, results, media_type="application/x-ndjson")
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """边读取请求体边输出的流式响应
+
+    ASGI spec 2.4 以下 StreamingResponse 会同时调用 receive 监听客户端断开，
+    与读取请求体争抢消息。这里读取请求体期间由 read_body() 感知断开，
+    请求体读完之后再监听 http.disconnect；服务器在客户端断开后会静默丢弃 send，
+    不监听的话生成器会一直运行到所有查询完成。
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        content: Callable[[AsyncIterator[bytes]], AsyncIterator[str]],
+        media_type: str | None = None,
+    ):
+        self.request = request
+        self.body_consumed = asyncio.Event()
+        super().__init__(content(self.read_body()), media_type=media_type)
+
+    async def read_body(self) -> AsyncIterator[bytes]:
+        """读取请求体，收到最后一段时就开始监听断开，而不是等到请求体处理完"""
+        while True:
+            message = await self.request.receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnect()
+            more_body = message.get("more_body", False)
+            if not more_body:
+                self.body_consumed.set()
+            if body := message.get("body", b""):
+                yield body
+            if not more_body:
+                return
+
+    async def listen_for_disconnect(self, receive: Receive):
+        await self.body_consumed.wait()
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        stream = asyncio.ensure_future(self.stream_response(send))
+        listener = asyncio.ensure_future(self.listen_for_disconnect(receive))
+        try:
+            await asyncio.wait({stream, listener}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stream.cancel()
+            listener.cancel()
+            await asyncio.gather(stream, listener, return_exceptions=True)
+            # 取消时生成器可能停在 yield 处，关闭它以执行 finally 中的清理
+            await self.body_iterator.aclose()  # type: ignore[attr-defined]
+
+        if stream.cancelled():
+            logger.info("Client disconnected, stream cancelled")
+            return
+        try:
+            stream.result()
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """逐行读取请求体，跳过空行"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line := line.strip():
+                yield line
+    if line := (buffer + decoder.decode(b"", final=True)).strip():
+        yield line
+
+
+async def batched(iterable: AsyncIterable[T], size: int) -> AsyncIterator[list[T]]:
+    chunk: list[T] = []
+    async for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def resolve_record(
+    key: LookupKey,
+    cached: IcpRecord | None,
+    session_pool: SessionPool,
+    query: Query,
+) -> QueryResponse | None:
+    """/query 的查询逻辑，上游确认没有记录时返回 None"""
+    if cached is not None:
+        if not is_stale(cached):
+            CACHE_LOOKUPS.labels("hit").inc()
+            return QueryResponse(cached=True, record=cached, age=cached.age)
+        CACHE_LOOKUPS.labels("stale").inc()
+        # 上游熔断期间直接返回过期记录，不再排队刷新
+        if session_pool.circuit_open:
+            return QueryResponse(cached=True, record=cached, age=cached.age, stale=True)
+        if cm.cache.stale_while_revalidate:
+            refresher.submit(
+                ("record", key), lambda: refresh_record(key, session_pool, query)
+            )
+            return QueryResponse(cached=True, record=cached, age=cached.age, stale=True)
+        try:
+            record = await lookup_upstream(key, session_pool, query)
+        except Exception as e:
+            logger.warning(f"Failed to refresh {key.value}, serving stale record: {e}")
+            record = None
+        if record is None:
+            return QueryResponse(cached=True, record=cached, age=cached.age, stale=True)
+        return QueryResponse(cached=False, record=record, age=record.age)
+
+    if query.is_missing(key):
+        CACHE_LOOKUPS.labels("negative").inc()
+        return None
+
+    CACHE_LOOKUPS.labels("miss").inc()
+    record = await lookup_upstream(key, session_pool, query)
+    if record is None:
+        return None
+    return QueryResponse(cached=False, record=record, age=record.age)
+
+
+@app.get("/query/list", response_model=QueryListResponse)
+async def query_icp_list(
+    name: str,
+    session_pool: SessionPool = SessionPoolDep,
+    query: Query = QueryDep,
 ):
-    if (cached := await query.get(name)) is not None:
-        return QueryResponse(cached=True, record=cached)
+    """返回全部分页的查询结果，例如某个单位名下的所有域名"""
+    key = lookup_key(name)
+    # /query 只保存第一页，只有抓取过全部分页的查询条件才直接使用数据库中的记录
+    listed = await query.get_list(key)
+    if listed is not None and (records := await query.find_all(key)):
+        if not listed.is_stale(cm.cache.record_ttl) and not any(
+            is_stale(record) for record in records
+        ):
+            CACHE_LOOKUPS.labels("hit").inc()
+            return QueryListResponse(cached=True, records=records)
+        CACHE_LOOKUPS.labels("stale").inc()
+        if session_pool.circuit_open:
+            return QueryListResponse(cached=True, records=records, stale=True)
+        if cm.cache.stale_while_revalidate:
+            refresher.submit(
+                ("list", key), lambda: refresh_records(key, session_pool, query)
+            )
+            return QueryListResponse(cached=True, records=records, stale=True)
+        try:
+            return QueryListResponse(
+                cached=False, records=await list_upstream(key, session_pool, query)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to refresh {key.value}, serving stale records: {e}")
+            return QueryListResponse(cached=True, records=records, stale=True)
+
+    if query.is_missing(key):
+        CACHE_LOOKUPS.labels("negative").inc()
+        return QueryListResponse(cached=True, records=[])
+
+    CACHE_LOOKUPS.labels("miss").inc()
+    records = await list_upstream(key, session_pool, query)
+    return QueryListResponse(cached=False, records=records)
+
 
-    uuid, auth = await auth_pool.get_auth()
+async def lookup_upstream(
+    key: LookupKey, session_pool: SessionPool, query: Query
+) -> IcpRecord | None:
+    return await inflight_lookups.do(
+        key, lambda: fetch_record(key, session_pool, query)
+    )
+
+
+async def list_upstream(
+    key: LookupKey, session_pool: SessionPool, query: Query
+) -> list[IcpRecord]:
+    return await inflight_lists.do(
+        key, lambda: fetch_records(key, session_pool, query, all_pages=True)
+    )
+
+
+async def fetch_record(
+    key: LookupKey, session_pool: SessionPool, query: Query
+) -> IcpRecord | None:
+    records = await fetch_records(
+        key, session_pool, query, all_pages=cm.upstream.fetch_all_pages
+    )
+    return match_record(key, records)
+
+
+async def fetch_records(
+    key: LookupKey, session_pool: SessionPool, query: Query, all_pages: bool
+) -> list[IcpRecord]:
+    """查询上游并在一个事务中保存全部结果"""
+    if all_pages:
+        res = await session_pool.lookup_all(key.upstream)
+    else:
+        res = await session_pool.lookup(key.upstream)
+
+    if not res:
+        query.mark_missing(key)
+        return []
+    records = [IcpRecord.from_query_result(result) for result in res]
+    saved = await query.save_all(records, key)
+    if all_pages:
+        await query.mark_listed([key])
+    return saved
+
+
+def is_stale(record: IcpRecord) -> bool:
+    return record.is_stale(cm.cache.record_ttl)
+
+
+async def refresh_record(key: LookupKey, session_pool: SessionPool, query: Query):
+    if key in inflight_lookups:
+        return
     try:
-        res = await auth_pool.query(uuid, auth, name)
-        await auth_pool.return_auth(uuid, auth)
+        await lookup_upstream(key, session_pool, query)
     except Exception as e:
-        raise e
+        logger.warning(f"Background refresh of {key.value} failed: {e}")
 
-    if res is not None and len(res) > 0:
-        record = IcpRecord.from_query_result(res[0])
-        await query.save(record)
-        return QueryResponse(cached=False, record=record)
-    else:
-        raise HTTPException(404, "not found")
+
+async def refresh_records(key: LookupKey, session_pool: SessionPool, query: Query):
+    if key in inflight_lists:
+        return
+    try:
+        await list_upstream(key, session_pool, query)
+    except Exception as e:
+        logger.warning(f"Background refresh of {key.value} failed: {e}")
@@ -0,0 +1,287 @@
+"""
+批量导入
+从文件逐行读取域名、单位名称或备案号，查询缓存未命中的部分并批量写入数据库，
+支持断点续传
+
+    python -m icp_query.bulk names.txt --checkpoint names.ckpt
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Iterator
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from .api.pool import SessionPool
+from .api.retry import CircuitOpenError
+from .api.solver import CaptchaSolver
+from .config import ConfigManager, load_config
+from .db import IcpRecord, Query, RecordCache, get_engine, init_db
+from .db.lookup import LookupKey, lookup_key
+from .logging import init_logger
+from .tracing import span, tracer
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 10
+
+
+class Checkpoint(BaseModel):
+    """导入进度，offset 之前的行均已处理并写入数据库"""
+
+    input: str
+    offset: int = 0
+    lines: int = 0
+    skipped: int = 0
+    fetched: int = 0
+    saved: int = 0
+    not_found: int = 0
+    failed: int = 0
+    finished: bool = False
+
+    @classmethod
+    def load(cls, path: Path, input: Path) -> "Checkpoint":
+        if not path.exists():
+            return cls(input=str(input.resolve()))
+        checkpoint = cls.model_validate_json(path.read_text())
+        if checkpoint.input != str(input.resolve()):
+            raise ValueError(f"断点文件 {path} 属于另一个输入文件 {checkpoint.input}")
+        return checkpoint
+
+    def dump(self, path: Path):
+        # 先写临时文件再替换，进程被杀时不会留下半个断点文件
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.model_dump_json(indent=2))
+        os.replace(tmp, path)
+
+
+class Line(BaseModel):
+    name: str
+    number: int = Field(..., description="行号（从 1 开始）")
+    end: int = Field(..., description="该行结束处在输入文件中的字节偏移")
+    done: bool = False
+
+
+def read_lines(path: Path, offset: int, number: int) -> Iterator[Line]:
+    with path.open("rb") as f:
+        f.seek(offset)
+        while raw := f.readline():
+            offset += len(raw)
+            number += 1
+            yield Line(name=raw.decode("utf-8").strip(), number=number, end=offset)
+
+
+class BulkImporter:
+    """逐块读取输入，缓存命中的跳过，未命中的并发查询上游，结果批量 upsert
+
+    断点只推进到最早一个尚未写入数据库的行，因此中断后重新运行最多重复查询
+    进行中的那一部分。
+    """
+
+    def __init__(
+        self,
+        cm: ConfigManager,
+        session_pool: SessionPool,
+        query: Query,
+        checkpoint: Checkpoint,
+        checkpoint_path: Path | None,
+        concurrency: int,
+        refresh: bool = False,
+        errors: Path | None = None,
+    ):
+        self.cm = cm
+        self.session_pool = session_pool
+        self.query = query
+        self.checkpoint = checkpoint
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.refresh = refresh
+        self.errors = errors
+        self.lines: deque[Line] = deque()
+        self.buffer: list[tuple[Line, list[IcpRecord]]] = []
+        self.pending: set[asyncio.Task] = set()
+        self.saved_at = time.monotonic()
+
+    async def run(self, input: Path):
+        chunk: list[Line] = []
+        checkpoint = self.checkpoint
+        for line in read_lines(input, checkpoint.offset, checkpoint.lines):
+            self.lines.append(line)
+            if not line.name:
+                line.done = True
+                continue
+            chunk.append(line)
+            if len(chunk) >= self.cm.batch.stream_chunk_size:
+                await self.process(chunk)
+                chunk = []
+        await self.process(chunk)
+
+        while self.pending:
+            await self.wait(0)
+        await self.flush()
+        self.checkpoint.finished = True
+        self.save_checkpoint()
+
+    async def process(self, chunk: list[Line]):
+        keys = [lookup_key(line.name) for line in chunk]
+        cached = await self.query.get_many(keys)
+        for line, key in zip(chunk, keys):
+            record = cached.get(key)
+            if (
+                record is not None
+                and not self.refresh
+                and not record.is_stale(self.cm.cache.record_ttl)
+            ):
+                line.done = True
+                self.checkpoint.skipped += 1
+                continue
+            self.pending.add(asyncio.create_task(self.fetch(line, key)))
+            await self.wait(self.concurrency - 1)
+
+        # 命中缓存的行也需要定期推进断点
+        if time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL:
+            await self.flush()
+
+    async def wait(self, limit: int):
+        while len(self.pending) > limit:
+            done, self.pending = await asyncio.wait(
+                self.pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                task.result()
+        if sum(len(records) for _, records in self.buffer) >= (
+            self.cm.database.batch_size
+        ):
+            await self.flush()
+
+    async def fetch(self, line: Line, key: LookupKey):
+        try:
+            while True:
+                try:
+                    with span("bulk.fetch", **{"bulk.line": line.number}):
+                        # 批量导入用于预热缓存，总是获取全部分页
+                        res = await self.session_pool.lookup_all(key.upstream)
+                    break
+                except CircuitOpenError as e:
+                    # 上游熔断时等待恢复，而不是把剩余输入都记为失败
+                    await asyncio.sleep(e.retry_after or 1)
+        except Exception as e:
+            logger.warning(f"Failed to look up {line.name}: {e}")
+            self.checkpoint.failed += 1
+            if self.errors is not None:
+                with self.errors.open("a", encoding="utf-8") as f:
+                    f.write(line.name + "\n")
+            line.done = True
+            return
+
+        self.checkpoint.fetched += 1
+        if not res:
+            self.checkpoint.not_found += 1
+            line.done = True
+            return
+        self.buffer.append(
+            (line, [IcpRecord.from_query_result(result) for result in res])
+        )
+
+    async def flush(self):
+        """写入缓冲的记录，然后推进断点"""
+        buffer, self.buffer = self.buffer, []
+        records = [record for _, records in buffer for record in records]
+        if records:
+            saved = await self.query.save_all(records)
+            self.checkpoint.saved += len(saved)
+            # 批量导入获取了全部分页，/query/list 可以直接使用这些记录
+            await self.query.mark_listed([lookup_key(line.name) for line, _ in buffer])
+        for line, _ in buffer:
+            line.done = True
+        self.save_checkpoint()
+        self.saved_at = time.monotonic()
+
+    def save_checkpoint(self):
+        while self.lines and self.lines[0].done:
+            line = self.lines.popleft()
+            self.checkpoint.offset = line.end
+            self.checkpoint.lines = line.number
+        if self.checkpoint_path is not None:
+            self.checkpoint.dump(self.checkpoint_path)
+        logger.info(
+            "Progress: %d lines, %d skipped, %d fetched, %d saved, "
+            "%d not found, %d failed",
+            self.checkpoint.lines,
+            self.checkpoint.skipped,
+            self.checkpoint.fetched,
+            self.checkpoint.saved,
+            self.checkpoint.not_found,
+            self.checkpoint.failed,
+        )
+
+
+async def main(args: argparse.Namespace):
+    cm = load_config()
+    init_logger(cm.logging, cm.env)
+
+    checkpoint_path: Path | None = args.checkpoint
+    if checkpoint_path is not None and args.restart:
+        checkpoint_path.unlink(missing_ok=True)
+    if checkpoint_path is not None:
+        checkpoint = Checkpoint.load(checkpoint_path, args.input)
+    else:
+        checkpoint = Checkpoint(input=str(args.input.resolve()))
+    if checkpoint.finished:
+        logger.info(f"{args.input} has already been imported, use --restart to rerun")
+        return
+    if checkpoint.offset:
+        logger.info(f"Resuming {args.input} from line {checkpoint.lines + 1}")
+
+    await init_db(cm.database)
+    query = Query(get_engine(), RecordCache(cm.cache), cm.database.batch_size)
+    tracer.configure(cm.tracing)
+    async with tracer:
+        with CaptchaSolver(cm.crack) as solver:
+            async with SessionPool(cm.upstream, cm.auth_pool, solver) as session_pool:
+                importer = BulkImporter(
+                    cm,
+                    session_pool,
+                    query,
+                    checkpoint,
+                    checkpoint_path,
+                    concurrency=args.concurrency or cm.batch.concurrency,
+                    refresh=args.refresh,
+                    errors=args.errors,
+                )
+                await importer.run(args.input)
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"需要大于 0 的整数: {value}")
+    return number
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m icp_query.bulk", description="从文件批量导入备案信息"
+    )
+    parser.add_argument("input", type=Path, help="输入文件，每行一个名称")
+    parser.add_argument("--checkpoint", type=Path, help="断点文件，用于中断后继续")
+    parser.add_argument("--restart", action="store_true", help="忽略已有断点重新开始")
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        help="同时查询上游的数量，默认为 batch.concurrency",
+    )
+    parser.add_argument(
+        "--refresh", action="store_true", help="重新查询已缓存且未过期的名称"
+    )
+    parser.add_argument("--errors", type=Path, help="将查询失败的名称追加写入该文件")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -5,6 +5,7 @@
 
 import logging
 import sys
+from typing import Literal
 
 from pydantic import BaseModel, Field
 from pydantic_settings import (
@@ -14,7 +15,8 @@ from pydantic_settings import (
     YamlConfigSettingsSource,
 )
 
-from .db.config import DatabaseConfig
+from .api.config import AuthPoolConfig, CrackConfig, UpstreamConfig
+from .db.config import CacheConfig, DatabaseConfig
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,43 @@ class LoggingConfig(BaseModel):
     level: str = Field("INFO", description="日志级别")
 
 
+class TracingConfig(BaseModel):
+    """请求追踪配置"""
+
+    exporter: Literal["none", "console", "file", "otlp"] = Field(
+        "none",
+        description=(
+            "span 的导出方式：none 关闭追踪，console 输出到日志，"
+            "file 以 JSON Lines 写入文件，otlp 以 OTLP/HTTP JSON 发送到 collector"
+        ),
+    )
+    file: str = Field("traces.jsonl", description="file 导出方式写入的文件")
+    otlp_endpoint: str = Field(
+        "http://localhost:4318/v1/traces", description="otlp 导出方式的 collector 地址"
+    )
+    service_name: str = Field("icp-query", description="导出 span 时的服务名")
+    sample_rate: float = Field(
+        1.0, ge=0, le=1, description="追踪的请求比例，在根 span 上采样"
+    )
+    batch_size: int = Field(512, ge=1, description="积累到该数量的 span 时立即导出")
+    max_queue: int = Field(
+        4096, ge=1, description="等待导出的 span 上限，超出时丢弃最早的 span"
+    )
+    flush_interval: float = Field(5, gt=0, description="定期导出 span 的间隔（秒）")
+
+
+class BatchConfig(BaseModel):
+    """批量查询配置"""
+
+    max_names: int = Field(1000, ge=1, description="单次批量查询最多包含的名称数")
+    concurrency: int = Field(
+        16, ge=1, description="单次批量查询中同时查询上游的最大数量"
+    )
+    stream_chunk_size: int = Field(
+        100, ge=1, description="流式查询每次读取并合并查询缓存的名称数"
+    )
+
+
 class ConfigManager(BaseSettings):
     """配置管理器"""
 
@@ -36,6 +75,12 @@ class ConfigManager(BaseSettings):
 
     logging: LoggingConfig
     database: DatabaseConfig
+    cache: CacheConfig = Field(default_factory=CacheConfig)  # type: ignore
+    crack: CrackConfig = Field(default_factory=CrackConfig)  # type: ignore
+    auth_pool: AuthPoolConfig = Field(default_factory=AuthPoolConfig)  # type: ignore
+    upstream: UpstreamConfig = Field(default_factory=UpstreamConfig)  # type: ignore
+    batch: BatchConfig = Field(default_factory=BatchConfig)  # type: ignore
+    tracing: TracingConfig = Field(default_factory=TracingConfig)  # type: ignore
 
     @classmethod
     def settings_customise_sources(
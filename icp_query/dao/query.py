@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
 
 from ..db.db import IcpRecord
 
@@ -6,3 +8,33 @@ from ..db.db import IcpRecord
 class QueryResponse(BaseModel):
     cached: bool
     record: IcpRecord
+    age: float | None = Field(None, description="记录距离上次抓取的秒数")
+    stale: bool = Field(False, description="记录已过期，正在后台刷新")
+
+
+class QueryListResponse(BaseModel):
+    cached: bool
+    records: list[IcpRecord]
+    stale: bool = Field(False, description="记录已过期，正在后台刷新")
+
+
+class BatchQueryRequest(BaseModel):
+    names: list[str] = Field(..., min_length=1, description="要查询的名称列表")
+
+
+class BatchQueryItem(BaseModel):
+    name: str = Field(..., description="请求中的原始名称")
+    status: Literal["ok", "not_found", "error"]
+    cached: bool = False
+    record: IcpRecord | None = None
+    age: float | None = Field(None, description="记录距离上次抓取的秒数")
+    stale: bool = Field(False, description="记录已过期，正在后台刷新")
+    error: str | None = Field(None, description="查询失败的原因")
+
+
+class BatchQueryResponse(BaseModel):
+    results: list[BatchQueryItem] = Field(..., description="与请求中的名称一一对应")
+
+
+class StreamQueryItem(BatchQueryItem):
+    index: int = Field(..., description="名称在请求中的序号（从 0 开始，不计空行）")
@@ -1,5 +1,17 @@
-from .config import DatabaseConfig
+from .cache import RecordCache
+from .config import CacheConfig, DatabaseConfig
 from .db import IcpRecord, get_engine, init_db
+from .lookup import LookupKey, lookup_key
 from .query import Query
 
-__all__ = ["get_engine", "init_db", "DatabaseConfig", "Query", "IcpRecord"]
+__all__ = [
+    "get_engine",
+    "init_db",
+    "CacheConfig",
+    "DatabaseConfig",
+    "Query",
+    "IcpRecord",
+    "LookupKey",
+    "lookup_key",
+    "RecordCache",
+]
@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from .config import CacheConfig
+from .db import IcpRecord
+
+
+class RecordCache:
+    """进程内的 IcpRecord 热点缓存
+
+    容量有限的 LRU，每个条目带有过期时间；也会缓存上游确认“未找到”的结果。
+    """
+
+    entries: OrderedDict[Hashable, tuple[float, IcpRecord | None]]
+
+    def __init__(self, config: CacheConfig):
+        self.config = config
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _lookup(self, key: Hashable) -> tuple[float, IcpRecord | None] | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key: Hashable) -> IcpRecord | None:
+        entry = self._lookup(key)
+        if entry is None or entry[1] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def is_missing(self, key: Hashable) -> bool:
+        """上游最近确认过该 key 没有备案信息"""
+        entry = self._lookup(key)
+        if entry is not None and entry[1] is None:
+            self.negative_hits += 1
+            return True
+        return False
+
+    def _put(self, key: Hashable, record: IcpRecord | None, ttl: float):
+        if self.config.size == 0 or ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, record)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.config.size:
+            self.entries.popitem(last=False)
+
+    def set(self, key: Hashable, record: IcpRecord):
+        self._put(key, record, self.config.ttl)
+
+    def set_missing(self, key: Hashable):
+        self._put(key, None, self.config.negative_ttl)
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+        }
@@ -12,3 +12,28 @@ class DatabaseConfig(BaseModel):
     )
     pool_size: int = Field(5, ge=1, description="连接池大小")
     max_overflow: int = Field(10, ge=0, description="连接池最大溢出")
+    batch_size: int = Field(
+        500, ge=1, description="批量写入时每条 INSERT 语句包含的最大记录数"
+    )
+
+
+class CacheConfig(BaseModel):
+    """进程内热点缓存配置"""
+
+    size: int = Field(10000, ge=0, description="最多缓存的记录数，0 表示禁用")
+    ttl: float = Field(300, ge=0, description="缓存记录的有效期（秒）")
+    negative_ttl: float = Field(
+        60, ge=0, description="上游“未找到”结果的缓存有效期（秒），0 表示不缓存"
+    )
+    record_ttl: float | None = Field(
+        7 * 24 * 3600,
+        gt=0,
+        description="数据库中的记录超过该时间（秒）视为过期，需要重新抓取；null 表示永不过期",
+    )
+    stale_while_revalidate: bool = Field(
+        True, description="记录过期时先返回旧数据，并在后台刷新"
+    )
+    refresh_concurrency: int = Field(4, ge=1, description="同时进行的后台刷新数")
+    refresh_queue_size: int = Field(
+        1000, ge=1, description="排队等待的后台刷新数上限，超出时丢弃，下次命中时再刷新"
+    )
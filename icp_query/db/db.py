@@ -6,10 +6,11 @@
 import logging
 from datetime import datetime
 
+from sqlalchemy import Connection, Index, Inspector, Table, inspect, text
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import Field, SQLModel
 
-from ..api.miit import QueryResult
+from ..api.models import QueryResult
 from .config import DatabaseConfig
 
 logger = logging.getLogger(__name__)
@@ -31,10 +32,10 @@ logger = logging.getLogger(__name__)
 #     }
 class IcpRecord(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    domain: str = Field(index=True, description="域名")
-    unit_name: str = Field(description="单位名称")
-    main_licence: str = Field(description="主备案号")
-    service_licence: str = Field(description="服务备案号")
+    domain: str = Field(index=True, unique=True, description="域名")
+    unit_name: str = Field(index=True, description="单位名称")
+    main_licence: str = Field(index=True, description="主备案号")
+    service_licence: str = Field(index=True, description="服务备案号")
     content_type_name: str | None = Field(description="内容类型名称", default=None)
     nature_name: str = Field(description="性质名称")
     leader_name: str | None = Field(description="负责人名称")
@@ -42,6 +43,23 @@ class IcpRecord(SQLModel, table=True):
     main_id: int | None = Field(description="主备案ID")
     service_id: int | None = Field(description="服务备案ID", default=None)
     update_record_time: datetime = Field(description="备案更新时间")
+    fetched_at: datetime | None = Field(
+        default_factory=datetime.now, description="从上游抓取的时间"
+    )
+
+    @property
+    def age(self) -> float | None:
+        """距离上次从上游抓取的秒数，旧数据没有抓取时间时为 None"""
+        if self.fetched_at is None:
+            return None
+        return (datetime.now() - self.fetched_at).total_seconds()
+
+    def is_stale(self, ttl: float | None) -> bool:
+        """记录是否超过 ttl 秒未刷新，ttl 为 None 时永不过期"""
+        if ttl is None:
+            return False
+        age = self.age
+        return age is None or age > ttl
 
     @staticmethod
     def from_query_result(result: QueryResult):
@@ -62,6 +80,29 @@ class IcpRecord(SQLModel, table=True):
         )
 
 
+class RecordList(SQLModel, table=True):
+    """某个查询条件的全部分页结果已从上游抓取并保存
+
+    /query 只保存第一页或匹配的一条记录，数据库中有记录不代表列表完整，
+    /query/list 只在存在未过期的标记时直接使用数据库中的记录。
+    """
+
+    __table_args__ = (Index("ix_recordlist_key", "field", "value", unique=True),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    field: str = Field(description="查询的列")
+    value: str = Field(description="规范化后的查询条件")
+    fetched_at: datetime = Field(
+        default_factory=datetime.now, description="从上游抓取全部分页的时间"
+    )
+
+    def is_stale(self, ttl: float | None) -> bool:
+        """标记是否超过 ttl 秒未刷新，ttl 为 None 时永不过期"""
+        if ttl is None:
+            return False
+        return (datetime.now() - self.fetched_at).total_seconds() > ttl
+
+
 engine: AsyncEngine | None = None
 
 
@@ -74,6 +115,57 @@ async def init_db(config: DatabaseConfig):
     )
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+
+def upgrade_schema(conn: Connection):
+    """为已存在的表补充新增的可空列与索引（create_all 不会修改已存在的表）"""
+    inspector = inspect(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        upgrade_columns(conn, inspector, table)
+        upgrade_indexes(conn, inspector, table)
+
+
+def upgrade_columns(conn: Connection, inspector: Inspector, table: Table):
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        if not column.nullable:
+            logger.warning(f"无法自动添加非空列 {table.name}.{column.name}")
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        logger.info(f"添加列 {table.name}.{column.name}")
+        conn.execute(
+            text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+        )
+
+
+def upgrade_indexes(conn: Connection, inspector: Inspector, table: Table):
+    existing = {index["name"]: index for index in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        current = existing.get(index.name)
+        if current is not None and bool(current["unique"]) == index.unique:
+            continue
+        if current is not None:
+            # 已有索引与模型中的索引同名，由 SQLAlchemy 生成各数据库的 DROP INDEX
+            # （MySQL 需要 ON table）
+            index.drop(conn)
+        if index.unique:
+            # 旧版本会为同一域名保存多条记录，建唯一索引前只保留最新的一条；
+            # MySQL 不允许在子查询中直接读取正在删除的表，需要包一层派生表
+            columns = ", ".join(column.name for column in index.columns)
+            result = conn.execute(
+                text(
+                    f"DELETE FROM {table.name} WHERE id NOT IN "
+                    f"(SELECT id FROM (SELECT MAX(id) AS id FROM {table.name} "
+                    f"GROUP BY {columns}) AS keep)"
+                )
+            )
+            if result.rowcount:
+                logger.info(f"删除 {table.name} 中 {result.rowcount} 条重复记录")
+        logger.info(f"创建索引 {index.name}")
+        index.create(conn)
 
 
 def get_engine() -> AsyncEngine:
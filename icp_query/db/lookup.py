@@ -0,0 +1,80 @@
+"""
+查询条件解析
+将用户输入的查询字符串规范化，并判断按哪一列查找缓存
+"""
+
+import dataclasses
+import re
+import unicodedata
+from collections.abc import Sequence
+from typing import Literal, TypeVar
+
+LookupField = Literal["domain", "unit_name", "main_licence", "service_licence"]
+
+# 京ICP备12345678号 / 京ICP备12345678号-1 / 京ICP证123456号
+LICENCE_RE = re.compile(r"^[一-龥]ICP[备证]\d+号(-\d+)?$")
+DOMAIN_RE = re.compile(
+    r"^(?:[\w-]{1,63}\.)+(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59}|[^\W\d_]{2,63})$"
+)
+CJK_RE = re.compile(r"[一-龥]")
+
+T = TypeVar("T")
+
+
+@dataclasses.dataclass(frozen=True)
+class LookupKey:
+    field: LookupField
+    value: str
+    # 发送给上游的原始查询字符串，不参与比较，规范化后等价的输入共享缓存
+    query: str = dataclasses.field(default="", compare=False)
+
+    @property
+    def upstream(self) -> str:
+        """向上游查询时使用的字符串：单位名称使用原始输入，其余使用规范化后的值"""
+        return self.query or self.value
+
+
+def normalize_domain(name: str) -> str:
+    domain = name.lower()
+    domain = re.sub(r"^[a-z][a-z0-9+.-]*://", "", domain)
+    domain = re.split(r"[/?#]", domain, maxsplit=1)[0]
+    domain = domain.rsplit("@", 1)[-1].split(":", 1)[0].rstrip(".")
+    if domain.startswith("www.") and domain.count(".") > 1:
+        domain = domain[4:]
+    return domain
+
+
+def lookup_key(name: str) -> LookupKey:
+    """解析查询字符串
+
+    备案号与域名会做全角转半角、大小写与 URL 前缀等规范化；其余视为单位名称，
+    缓存键只合并多余的空白，中文名称中的半角括号统一为全角，上游查询使用原始输入。
+    包含空白或中文的输入不会被当作域名，例如 "Example Co.Ltd"。
+    """
+    name = name.strip()
+    normalized = unicodedata.normalize("NFKC", name)
+    compact = normalized.replace(" ", "")
+
+    licence = compact.upper()
+    if LICENCE_RE.match(licence):
+        if "-" in licence:
+            return LookupKey("service_licence", licence)
+        return LookupKey("main_licence", licence)
+
+    if not re.search(r"\s", normalized) and not CJK_RE.search(normalized):
+        domain = normalize_domain(normalized)
+        if DOMAIN_RE.match(domain):
+            return LookupKey("domain", domain)
+
+    unit_name = re.sub(r"\s+", " ", name)
+    if CJK_RE.search(unit_name):
+        unit_name = unit_name.replace("(", "（").replace(")", "）")
+    return LookupKey("unit_name", unit_name, name)
+
+
+def match_record(key: LookupKey, records: Sequence[T]) -> T | None:
+    """从一组查询结果中选出与查询条件对应的记录，没有完全匹配时取第一条"""
+    for record in records:
+        if getattr(record, key.field) == key.value:
+            return record
+    return records[0] if records else None
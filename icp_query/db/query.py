@@ -1,27 +1,243 @@
 import logging
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
 
 from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .db import IcpRecord
+from ..metrics import DB_QUERY_SECONDS
+from ..tracing import span
+from .cache import RecordCache
+from .db import IcpRecord, RecordList
+from .lookup import LookupKey, match_record
 
 logger = logging.getLogger(__name__)
 
 
 class Query:
-    def __init__(self, engine: AsyncEngine):
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        cache: RecordCache | None = None,
+        batch_size: int = 500,
+    ):
         self.engine = engine
+        self.cache = cache
+        self.batch_size = batch_size
 
-    async def get(self, domain: str):
-        async with AsyncSession(self.engine) as session:
-            statement = select(IcpRecord).where(IcpRecord.domain == domain)
-            result = await session.exec(statement)
-            return result.first()
+    async def get(self, key: LookupKey):
+        """按域名、单位名称或备案号查找记录"""
+        if self.cache is not None and (record := self.cache.get(key)) is not None:
+            return record
+
+        with (
+            span("db.get", **{"db.field": key.field}),
+            DB_QUERY_SECONDS.labels("get").time(),
+        ):
+            async with AsyncSession(self.engine) as session:
+                column = getattr(IcpRecord, key.field)
+                statement = (
+                    select(IcpRecord).where(column == key.value).order_by(IcpRecord.id)  # type: ignore
+                )
+                result = await session.exec(statement)
+                record = result.first()
+
+        if self.cache is not None and record is not None:
+            self.cache.set(key, record)
+        return record
+
+    async def get_many(self, keys: list[LookupKey]) -> dict[LookupKey, IcpRecord]:
+        """批量查找记录，缓存未命中的部分按列各用一条 IN 查询取出"""
+        found: dict[LookupKey, IcpRecord] = {}
+        misses: dict[str, set[str]] = {}
+        for key in dict.fromkeys(keys):
+            if self.cache is not None and (record := self.cache.get(key)) is not None:
+                found[key] = record
+            else:
+                misses.setdefault(key.field, set()).add(key.value)
+        if not misses:
+            return found
+
+        loaded: dict[LookupKey, IcpRecord] = {}
+        with (
+            span("db.get_many", **{"db.keys": len(keys)}),
+            DB_QUERY_SECONDS.labels("get_many").time(),
+        ):
+            async with AsyncSession(self.engine) as session:
+                for field, values in misses.items():
+                    column = getattr(IcpRecord, field)
+                    statement = (
+                        select(IcpRecord)
+                        .where(column.in_(values))  # type: ignore
+                        .order_by(IcpRecord.id)  # type: ignore
+                    )
+                    for record in await session.exec(statement):
+                        # 与 get 一致，同一条件匹配多条记录时取最早的一条
+                        loaded.setdefault(
+                            LookupKey(field, getattr(record, field)), record
+                        )  # type: ignore
+
+        if self.cache is not None:
+            for key, record in loaded.items():
+                self.cache.set(key, record)
+        return found | loaded
+
+    async def find_all(self, key: LookupKey) -> list[IcpRecord]:
+        """列出符合条件的全部记录"""
+        with (
+            span("db.find_all", **{"db.field": key.field}),
+            DB_QUERY_SECONDS.labels("find_all").time(),
+        ):
+            async with AsyncSession(self.engine) as session:
+                column = getattr(IcpRecord, key.field)
+                statement = (
+                    select(IcpRecord).where(column == key.value).order_by(IcpRecord.id)  # type: ignore
+                )
+                return list(await session.exec(statement))
+
+    async def get_list(self, key: LookupKey) -> RecordList | None:
+        """查询条件的全部分页结果是否抓取过，返回抓取标记"""
+        with (
+            span("db.get_list", **{"db.field": key.field}),
+            DB_QUERY_SECONDS.labels("get_list").time(),
+        ):
+            async with AsyncSession(self.engine) as session:
+                statement = select(RecordList).where(
+                    RecordList.field == key.field, RecordList.value == key.value
+                )
+                return (await session.exec(statement)).first()
+
+    async def mark_listed(self, keys: list[LookupKey]):
+        """记录这些查询条件的全部分页结果已经抓取并保存"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return
+        now = datetime.now()
+        with (
+            span("db.mark_listed", **{"db.keys": len(keys)}),
+            DB_QUERY_SECONDS.labels("mark_listed").time(),
+        ):
+            if (insert := upsert_insert(self.engine.dialect.name)) is not None:
+                async with self.engine.begin() as conn:
+                    statement = insert(RecordList).values(
+                        [
+                            {"field": key.field, "value": key.value, "fetched_at": now}
+                            for key in keys
+                        ]
+                    )
+                    await conn.execute(
+                        statement.on_conflict_do_update(
+                            index_elements=[RecordList.field, RecordList.value],
+                            set_={"fetched_at": statement.excluded.fetched_at},
+                        )
+                    )
+                return
+            async with AsyncSession(self.engine) as session:
+                for key in keys:
+                    statement = select(RecordList).where(
+                        RecordList.field == key.field, RecordList.value == key.value
+                    )
+                    marker = (await session.exec(statement)).first()
+                    if marker is None:
+                        marker = RecordList(field=key.field, value=key.value)
+                    marker.fetched_at = now
+                    session.add(marker)
+                await session.commit()
+
+    def is_missing(self, key: LookupKey) -> bool:
+        return self.cache is not None and self.cache.is_missing(key)
+
+    def mark_missing(self, key: LookupKey):
+        if self.cache is not None:
+            self.cache.set_missing(key)
 
-    async def save(self, record: IcpRecord):
-        async with AsyncSession(self.engine) as session:
-            session.add(record)
+    async def save(self, record: IcpRecord, key: LookupKey | None = None):
+        """保存记录；key 为触发本次查询的条件，同时缓存在该条件下"""
+        return (await self.save_all([record], key))[0]
+
+    async def save_all(
+        self, records: list[IcpRecord], key: LookupKey | None = None
+    ) -> list[IcpRecord]:
+        """在一个事务中按域名 upsert 多条记录并逐条放入缓存；key 为触发本次查询的条件"""
+        if not records:
+            return []
+        # 同一批中域名重复时以最后一条为准，否则 ON CONFLICT 会在同一语句中更新同一行两次
+        records = list({record.domain: record for record in records}.values())
+        with (
+            span("db.save_all", **{"db.records": len(records)}),
+            DB_QUERY_SECONDS.labels("save_all").time(),
+        ):
+            if (insert := upsert_insert(self.engine.dialect.name)) is not None:
+                await self._upsert(insert, records)
+            else:
+                await self._merge(records)
+
+        if self.cache is not None:
+            for record in records:
+                self.cache.set(LookupKey("domain", record.domain), record)
+            if key is not None and (record := match_record(key, records)) is not None:
+                self.cache.set(key, record)
+        return records
+
+    async def _upsert(self, insert: Callable[..., Any], records: list[IcpRecord]):
+        """INSERT ... ON CONFLICT (domain) DO UPDATE，通过 RETURNING 取回主键"""
+        ids: dict[str, int] = {}
+        async with self.engine.begin() as conn:
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start : start + self.batch_size]
+                statement = insert(IcpRecord).values(
+                    [record.model_dump(exclude={"id"}) for record in batch]
+                )
+                statement = statement.on_conflict_do_update(
+                    index_elements=[IcpRecord.domain],
+                    set_={
+                        column: statement.excluded[column] for column in UPSERT_COLUMNS
+                    },
+                ).returning(IcpRecord.domain, IcpRecord.id)  # type: ignore
+                for domain, id in await conn.execute(statement):
+                    ids[domain] = id
+        for record in records:
+            record.id = ids.get(record.domain)
+
+    async def _merge(self, records: list[IcpRecord]):
+        """不支持 ON CONFLICT 的数据库：先查出已有记录再逐条更新或插入"""
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            statement = select(IcpRecord).where(
+                IcpRecord.domain.in_([record.domain for record in records])  # type: ignore
+            )
+            existing = {
+                record.domain: record for record in await session.exec(statement)
+            }
+            merged = []
+            for record in records:
+                if (current := existing.get(record.domain)) is not None:
+                    for field, value in record.model_dump(exclude={"id"}).items():
+                        setattr(current, field, value)
+                    record = current
+                session.add(record)
+                merged.append(record)
             await session.commit()
-            await session.refresh(record)
-            return record
+        for record, saved in zip(records, merged):
+            record.id = saved.id
+
+
+UPSERT_COLUMNS = [
+    column.name
+    for column in IcpRecord.__table__.columns  # type: ignore
+    if column.name not in ("id", "domain")
+]
+
+
+def upsert_insert(dialect: str) -> Callable[..., Any] | None:
+    """返回支持 ON CONFLICT ... DO UPDATE 的 insert 构造函数"""
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+
+        return insert
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert
+    return None
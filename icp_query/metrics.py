@@ -0,0 +1,153 @@
+"""
+Prometheus 指标
+计数器与直方图在事件发生时记录；认证池、熔断器与热点缓存的状态在抓取时由
+collector 读取，不需要在各处维护 Gauge
+"""
+
+import time
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+# 上游与数据库模块会导入本模块记录指标，这里只在类型检查时导入它们
+if TYPE_CHECKING:
+    from .api.pool import SessionPool
+    from .db.cache import RecordCache
+
+CACHE_LOOKUPS = Counter(
+    "icp_cache_lookups_total",
+    "Lookups by cache outcome: hit, stale, miss or negative (cached not found)",
+    ["result"],
+)
+
+BACKGROUND_REFRESHES = Counter(
+    "icp_background_refreshes_total",
+    "Stale record refreshes by result: queued, deduplicated or dropped (queue full)",
+    ["result"],
+)
+
+CAPTCHA_SOLVES = Counter(
+    "icp_captcha_solves_total",
+    "Captcha solve attempts by result: success or the upstream error class",
+    ["result"],
+)
+
+CRACK_STAGE_SECONDS = Histogram(
+    "icp_crack_stage_seconds",
+    "Time spent in each stage of the captcha recognition pipeline",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+AUTH_LEASE_AGE_SECONDS = Histogram(
+    "icp_auth_lease_age_seconds",
+    "Age of auth leases when they are handed out",
+    buckets=(1, 5, 15, 30, 60, 120, 180, 240, 300, 600),
+)
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "icp_upstream_request_seconds",
+    "Upstream request latency by endpoint and outcome",
+    ["endpoint", "outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30),
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "icp_db_query_seconds",
+    "Database query latency by operation",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+class SessionPoolCollector(Collector):
+    """抓取时读取各会话认证池、自适应并发与熔断器的状态"""
+
+    def __init__(self, session_pool: "SessionPool"):
+        self.session_pool = session_pool
+
+    def collect(self) -> Iterator[Metric]:
+        available = GaugeMetricFamily(
+            "icp_auth_pool_available",
+            "Auth leases waiting in the pool",
+            labels=["session"],
+        )
+        leased = GaugeMetricFamily(
+            "icp_auth_pool_leased", "Auth leases currently in use", labels=["session"]
+        )
+        solving = GaugeMetricFamily(
+            "icp_auth_pool_solving", "Captchas being solved", labels=["session"]
+        )
+        oldest = GaugeMetricFamily(
+            "icp_auth_pool_oldest_lease_seconds",
+            "Age of the oldest pooled or leased auth",
+            labels=["session"],
+        )
+        inflight = GaugeMetricFamily(
+            "icp_upstream_inflight_lookups",
+            "Lookups in progress",
+            labels=["session"],
+        )
+        now = time.monotonic()
+        for i, session in enumerate(self.session_pool.sessions):
+            label = [str(i)]
+            leases = [*session.pool, *session.leased.values()]
+            available.add_metric(label, len(session.pool))
+            leased.add_metric(label, len(session.leased))
+            solving.add_metric(label, session.solving)
+            oldest.add_metric(
+                label, max((now - lease.created_at for lease in leases), default=0)
+            )
+            inflight.add_metric(label, session.inflight)
+        yield from (available, leased, solving, oldest, inflight)
+
+        if (concurrency := self.session_pool.concurrency) is not None:
+            yield GaugeMetricFamily(
+                "icp_upstream_concurrency_limit",
+                "Current adaptive upstream concurrency limit",
+                value=concurrency.limit,
+            )
+            yield GaugeMetricFamily(
+                "icp_upstream_concurrency_inflight",
+                "Upstream requests holding a concurrency slot",
+                value=concurrency.inflight,
+            )
+        yield GaugeMetricFamily(
+            "icp_upstream_circuit_open",
+            "1 while the upstream circuit breaker is open",
+            value=int(self.session_pool.circuit_open),
+        )
+
+
+class RecordCacheCollector(Collector):
+    """导出进程内热点缓存的大小与命中统计"""
+
+    def __init__(self, cache: "RecordCache"):
+        self.cache = cache
+
+    def collect(self) -> Iterator[Metric]:
+        stats = self.cache.stats()
+        yield GaugeMetricFamily(
+            "icp_record_cache_size", "Entries in the record cache", value=stats["size"]
+        )
+        requests = CounterMetricFamily(
+            "icp_record_cache_requests",
+            "Record cache requests by result",
+            labels=["result"],
+        )
+        for result in ("hits", "negative_hits", "misses"):
+            requests.add_metric([result], stats[result])
+        yield requests
+
+
+def register(*collectors: Collector):
+    for collector in collectors:
+        REGISTRY.register(collector)
+
+
+def unregister(*collectors: Collector):
+    for collector in collectors:
+        REGISTRY.unregister(collector)
@@ -0,0 +1,67 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+
+from verboselogs import VerboseLogger
+
+from .db.config import CacheConfig
+from .metrics import BACKGROUND_REFRESHES
+
+
+class Refresher:
+    """后台刷新过期记录
+
+    stale-while-revalidate 命中过期记录时把刷新交给固定数量的后台工作者，
+    排队的刷新不超过 refresh_queue_size，同一个键排队或刷新期间不重复添加。
+    队列满时直接丢弃，下次命中该记录时会再次排队。批量与流式查询命中大量过期记录时，
+    内存占用与上游请求量不随请求规模增长。
+    """
+
+    logger = VerboseLogger("Refresher")
+
+    def __init__(self, config: CacheConfig):
+        self.config = config
+        self.queue: asyncio.Queue[tuple[Hashable, Callable[[], Awaitable[object]]]] = (
+            asyncio.Queue(config.refresh_queue_size)
+        )
+        self.keys: set[Hashable] = set()
+        self.workers: list[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def submit(self, key: Hashable, refresh: Callable[[], Awaitable[object]]) -> bool:
+        """排队刷新，返回是否加入了队列"""
+        if key in self.keys:
+            BACKGROUND_REFRESHES.labels("deduplicated").inc()
+            return False
+        try:
+            self.queue.put_nowait((key, refresh))
+        except asyncio.QueueFull:
+            BACKGROUND_REFRESHES.labels("dropped").inc()
+            return False
+        self.keys.add(key)
+        BACKGROUND_REFRESHES.labels("queued").inc()
+        return True
+
+    async def _worker(self):
+        while True:
+            key, refresh = await self.queue.get()
+            try:
+                await refresh()
+            except Exception as e:
+                self.logger.warning(f"Background refresh of {key} failed: {e}")
+            finally:
+                self.keys.discard(key)
+
+    async def __aenter__(self):
+        self.workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.config.refresh_concurrency)
+        ]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
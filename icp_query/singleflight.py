@@ -0,0 +1,37 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """合并同一 key 的并发调用
+
+    同一时刻对同一 key 只执行一次 fn，其他调用方等待并共享同一个结果（或异常）。
+    fn 在独立的任务中运行，某个调用方被取消不会影响其他调用方。
+    """
+
+    def __init__(self):
+        self.calls: dict[Hashable, asyncio.Task[T]] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.calls
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task[T]):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # 所有调用方都已取消时避免 "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,314 @@
+"""
+请求追踪
+轻量的 span 实现，字段与 OpenTelemetry 一致：span 在 contextvars 中传递父子关系，
+结束后批量导出到控制台、JSON Lines 日志文件，或以 OTLP/HTTP JSON 格式发送到
+本地 collector（如 OpenTelemetry Collector、Jaeger）
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import httpx
+from pydantic import BaseModel, Field
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from verboselogs import VerboseLogger
+
+# 被追踪的模块会导入本模块，这里只在类型检查时导入配置
+if TYPE_CHECKING:
+    from .config import TracingConfig
+
+AttributeValue = str | int | float | bool
+
+
+class Span(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None = None
+    start_ns: int = Field(default_factory=time.time_ns)
+    end_ns: int | None = None
+    attributes: dict[str, AttributeValue] = Field(default_factory=dict)
+    error: str | None = None
+    sampled: bool = True
+
+    @property
+    def duration(self) -> float:
+        """耗时（秒），未结束时为到目前为止的耗时"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, key: str, value: AttributeValue | None):
+        if value is not None and self.sampled:
+            self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        """OTLP JSON 编码的 span"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error}
+            if self.error is not None
+            else {"code": 1},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def otlp_attribute(key: str, value: AttributeValue) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# 追踪关闭时使用的空 span，不进入上下文也不导出
+NOOP_SPAN = Span(name="", trace_id="0" * 32, span_id="0" * 16, sampled=False)
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class SpanExporter:
+    async def export(self, spans: list[Span]): ...
+
+    async def close(self): ...
+
+
+class ConsoleExporter(SpanExporter):
+    logger = VerboseLogger("Trace")
+
+    async def export(self, spans: list[Span]):
+        for span in spans:
+            status = f" error={span.error!r}" if span.error is not None else ""
+            self.logger.info(
+                f"{span.name} {span.duration * 1000:.1f}ms "
+                f"trace={span.trace_id} span={span.span_id} "
+                f"parent={span.parent_id}{status} {span.attributes}"
+            )
+
+
+class FileExporter(SpanExporter):
+    """每行一个 OTLP JSON 编码的 span"""
+
+    def __init__(self, path: Path, service_name: str):
+        self.path = path
+        self.service_name = service_name
+
+    async def export(self, spans: list[Span]):
+        lines = "".join(
+            json.dumps(
+                {"service.name": self.service_name, **span.to_otlp()},
+                ensure_ascii=False,
+            )
+            + "\n"
+            for span in spans
+        )
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: str):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class OtlpExporter(SpanExporter):
+    """以 OTLP/HTTP JSON 发送到 collector 的 /v1/traces"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.client = httpx.AsyncClient(timeout=10)
+
+    async def export(self, spans: list[Span]):
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            otlp_attribute("service.name", self.service_name)
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "icp_query"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        res = await self.client.post(self.endpoint, json=payload)
+        res.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class Tracer:
+    """创建 span 并在后台批量导出
+
+    采样在根 span 上决定，子 span 继承父 span 的采样结果，同一条链路要么完整
+    导出，要么完全不导出。
+    """
+
+    logger = VerboseLogger("Tracer")
+
+    def __init__(self):
+        self.config: "TracingConfig | None" = None
+        self.exporter: SpanExporter | None = None
+        self.pending: list[Span] = []
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def configure(self, config: "TracingConfig"):
+        self.config = config
+        if config.exporter == "console":
+            self.exporter = ConsoleExporter()
+        elif config.exporter == "file":
+            self.exporter = FileExporter(Path(config.file), config.service_name)
+        elif config.exporter == "otlp":
+            self.exporter = OtlpExporter(config.otlp_endpoint, config.service_name)
+        else:
+            self.exporter = None
+        if self.exporter is not None:
+            self.logger.info(
+                f"Tracing enabled: exporter={config.exporter}, "
+                f"sample_rate={config.sample_rate}"
+            )
+
+    @contextmanager
+    def span(self, name: str, **attributes: AttributeValue | None) -> Iterator[Span]:
+        if self.config is None or self.exporter is None:
+            yield NOOP_SPAN
+            return
+
+        parent = current_span.get()
+        if parent is None:
+            span = Span(
+                name=name,
+                trace_id=f"{random.getrandbits(128):032x}",
+                span_id=f"{random.getrandbits(64):016x}",
+                sampled=random.random() < self.config.sample_rate,
+            )
+        else:
+            span = Span(
+                name=name,
+                trace_id=parent.trace_id,
+                span_id=f"{random.getrandbits(64):016x}",
+                parent_id=parent.span_id,
+                sampled=parent.sampled,
+            )
+        for key, value in attributes.items():
+            span.set(key, value)
+
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if span.sampled:
+                self._finish(span)
+
+    def _finish(self, span: Span):
+        assert self.config is not None
+        self.pending.append(span)
+        if len(self.pending) > self.config.max_queue:
+            # 导出跟不上时丢弃最早的 span，不让内存无限增长
+            overflow = len(self.pending) - self.config.max_queue
+            del self.pending[:overflow]
+            self.dropped += overflow
+        if len(self.pending) >= self.config.batch_size:
+            self.wakeup.set()
+
+    async def flush(self):
+        if self.exporter is None or not self.pending:
+            return
+        spans, self.pending = self.pending, []
+        try:
+            await self.exporter.export(spans)
+        except Exception as e:
+            self.logger.warning(f"Failed to export {len(spans)} spans: {e}")
+        if self.dropped:
+            self.logger.warning(f"Dropped {self.dropped} spans, exporter too slow")
+            self.dropped = 0
+
+    async def _run(self):
+        assert self.config is not None
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.wakeup.wait(), timeout=self.config.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def __aenter__(self):
+        if self.exporter is not None:
+            self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+        if self.exporter is not None:
+            await self.exporter.close()
+
+
+tracer = Tracer()
+span = tracer.span
+
+
+class TracingMiddleware:
+    """为每个 HTTP 请求创建根 span，同一请求内的查询、上游调用与数据库操作都挂在其下
+
+    使用纯 ASGI 中间件而不是 BaseHTTPMiddleware，不影响边读请求体边输出的流式接口；
+    对于流式响应，span 在响应体发送完毕后结束。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        with span(
+            f"{scope['method']} {scope['path']}",
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        ) as request_span:
+
+            async def send_with_status(message: Message):
+                if message["type"] == "http.response.start":
+                    request_span.set("http.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
@@ -0,0 +1,257 @@
+"""
+验证码识别离线基准测试
+读取 scripts/fetch.py 保存的验证码（data/big/<uuid>.png 与 data/small/<uuid>.png），
+统计识别各阶段的延迟分位数、1..N 个工作者下每秒识别的验证码数，以及与标注对比的准确率。
+需要在项目根目录运行（模型文件 siamese.onnx 按当前目录加载）：
+
+    python scripts/bench_crack.py --data data --workers 4
+    python scripts/bench_crack.py --data data --record-labels
+    python scripts/bench_crack.py --data data --output after.json --baseline before.json
+    python scripts/bench_crack.py --data data --max-background-distance 30
+
+标注文件（默认 data/labels.json）记录每个验证码按小图字符顺序应点击的目标框左上角坐标：
+{"<uuid>": [[x, y], [x, y], [x, y], [x, y]]}。--record-labels 用当前识别结果为尚未标注的
+验证码生成标注，人工核对修正后即可作为之后修改识别流程的回归基准。
+--max-background-distance 与服务的 crack.max_background_distance 相同，用于在真实语料上
+确认该阈值不会误拒已收录的背景（被拒绝的验证码计入识别错误）。
+"""
+
+import argparse
+import base64
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+from pydantic import BaseModel
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from icp_query.api.solver import get_crack, init_worker  # noqa: E402
+
+STAGES = ["find_background", "detection", "siamese", "total"]
+
+
+class Sample(BaseModel):
+    uuid: str
+    big: str
+    small: str
+
+
+class Result(BaseModel):
+    uuid: str
+    points: list[list[int]] | None = None
+    confidence: float | None = None
+    error: str | None = None
+    timings: dict[str, float] = {}
+
+
+def load_corpus(data: Path, limit: int | None) -> list[Sample]:
+    samples = []
+    for big in sorted((data / "big").glob("*.png")):
+        small = data / "small" / big.name
+        if not small.exists():
+            continue
+        samples.append(
+            Sample(
+                uuid=big.stem,
+                big=base64.b64encode(big.read_bytes()).decode(),
+                small=base64.b64encode(small.read_bytes()).decode(),
+            )
+        )
+        if limit is not None and len(samples) >= limit:
+            break
+    return samples
+
+
+def solve(sample: Sample, max_background_distance: float | None = None) -> Result:
+    """在工作线程/进程中识别一个验证码，与服务中 generate_pointjson 的识别部分一致"""
+    crack = get_crack()
+    crack.timings.clear()
+    start = time.perf_counter()
+    try:
+        boxes = crack.detect(
+            sample.big, max_background_distance=max_background_distance
+        )
+        points, confidence = crack.siamese(sample.small, boxes)
+    except Exception as e:
+        return Result(uuid=sample.uuid, error=f"{type(e).__name__}: {e}")
+    timings = dict(crack.timings, total=time.perf_counter() - start)
+    return Result(
+        uuid=sample.uuid,
+        points=[[int(x), int(y)] for x, y in points],
+        confidence=confidence,
+        timings=timings,
+    )
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    ms = np.array(values) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p90": float(np.percentile(ms, 90)),
+        "p99": float(np.percentile(ms, 99)),
+        "mean": float(ms.mean()),
+    }
+
+
+def is_correct(result: Result, label: list[list[int]], tolerance: int) -> bool:
+    if result.points is None or len(result.points) != len(label):
+        return False
+    return all(
+        abs(px - lx) <= tolerance and abs(py - ly) <= tolerance
+        for (px, py), (lx, ly) in zip(result.points, label)
+    )
+
+
+def create_executor(kind: str, workers: int) -> Executor:
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, initializer=init_worker)
+    # 与服务一致使用 spawn 启动工作进程
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context("spawn"), initializer=init_worker
+    )
+
+
+def measure_throughput(
+    samples: list[Sample],
+    workers: int,
+    kind: str,
+    max_background_distance: float | None = None,
+) -> float:
+    """每秒识别的验证码数，不计工作者加载模型的时间"""
+    task = functools.partial(solve, max_background_distance=max_background_distance)
+    with create_executor(kind, workers) as executor:
+        # 预热：让每个工作者都完成模型加载
+        list(executor.map(task, samples[:workers]))
+        start = time.perf_counter()
+        list(executor.map(task, samples))
+        return len(samples) / (time.perf_counter() - start)
+
+
+def main(args: argparse.Namespace):
+    samples = load_corpus(args.data, args.limit)
+    if not samples:
+        sys.exit(f"{args.data}/big 与 {args.data}/small 中没有成对的验证码图片")
+    labels_path: Path = args.labels or args.data / "labels.json"
+    labels: dict[str, list[list[int]]] = (
+        json.loads(labels_path.read_text()) if labels_path.exists() else {}
+    )
+    print(f"Corpus: {len(samples)} captchas, {len(labels)} labels")
+
+    # 单线程逐个识别，统计各阶段延迟；第一个验证码包含模型加载，不计入
+    solve(samples[0])
+    results = [solve(sample, args.max_background_distance) for sample in samples]
+
+    report: dict = {"captchas": len(samples), "latency_ms": {}, "throughput": {}}
+    print(f"\n{'stage':<16}{'p50':>10}{'p90':>10}{'p99':>10}{'mean':>10}  (ms)")
+    for stage in STAGES:
+        stats = percentiles([r.timings[stage] for r in results if stage in r.timings])
+        report["latency_ms"][stage] = stats
+        if stats:
+            print(
+                f"{stage:<16}{stats['p50']:>10.2f}{stats['p90']:>10.2f}"
+                f"{stats['p99']:>10.2f}{stats['mean']:>10.2f}"
+            )
+
+    failed = [r for r in results if r.error is not None]
+    labelled = [r for r in results if r.uuid in labels]
+    correct = sum(is_correct(r, labels[r.uuid], args.tolerance) for r in labelled)
+    report["failed"] = len(failed)
+    report["labelled"] = len(labelled)
+    report["accuracy"] = correct / len(labelled) if labelled else None
+    print(f"\nRecognition errors: {len(failed)}/{len(results)}")
+    for r in failed[: args.show_errors]:
+        print(f"  {r.uuid}: {r.error}")
+    if labelled:
+        print(
+            f"Accuracy: {correct}/{len(labelled)} = {correct / len(labelled):.1%} "
+            f"(tolerance {args.tolerance}px)"
+        )
+    else:
+        print("Accuracy: no labels, run with --record-labels to create them")
+
+    print(f"\n{'workers':<10}{'captchas/s':>12}  ({args.executor})")
+    for workers in range(1, args.workers + 1):
+        rate = measure_throughput(
+            samples, workers, args.executor, args.max_background_distance
+        )
+        report["throughput"][workers] = rate
+        print(f"{workers:<10}{rate:>12.2f}")
+
+    if args.record_labels:
+        new = {
+            r.uuid: r.points
+            for r in results
+            if r.points is not None and r.uuid not in labels
+        }
+        labels_path.write_text(json.dumps(labels | new, indent=2))
+        print(f"\nRecorded {len(new)} new labels to {labels_path}")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline is not None:
+        compare(json.loads(args.baseline.read_text()), report)
+
+
+def compare(baseline: dict, report: dict):
+    """与之前保存的结果对比，便于修改识别流程后检查回归"""
+    print("\nCompared with baseline:")
+    for stage in STAGES:
+        before = baseline["latency_ms"].get(stage, {}).get("p50")
+        after = report["latency_ms"].get(stage, {}).get("p50")
+        if before and after:
+            print(f"  {stage:<16} p50 {before:8.2f} -> {after:8.2f} ms")
+    if baseline.get("accuracy") is not None and report["accuracy"] is not None:
+        print(f"  accuracy {baseline['accuracy']:.1%} -> {report['accuracy']:.1%}")
+    for workers, rate in report["throughput"].items():
+        if (before := baseline["throughput"].get(str(workers))) is not None:
+            print(f"  {workers} workers {before:8.2f} -> {rate:8.2f} captchas/s")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="验证码识别离线基准测试")
+    parser.add_argument(
+        "--data", type=Path, default=Path("data"), help="包含 big/ 与 small/ 的目录"
+    )
+    parser.add_argument(
+        "--labels", type=Path, help="标注文件，默认为 <data>/labels.json"
+    )
+    parser.add_argument("--limit", type=int, help="最多使用的验证码数量")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="吞吐量测试的最大工作者数，依次测试 1..N",
+    )
+    parser.add_argument("--executor", choices=["thread", "process"], default="process")
+    parser.add_argument(
+        "--tolerance", type=int, default=10, help="坐标与标注相差不超过该像素数视为正确"
+    )
+    parser.add_argument(
+        "--record-labels",
+        action="store_true",
+        help="用当前识别结果为尚未标注的验证码生成标注",
+    )
+    parser.add_argument(
+        "--max-background-distance",
+        type=float,
+        help="与最接近的背景模板距离超过该值时放弃，默认不检查",
+    )
+    parser.add_argument("--output", type=Path, help="将结果保存为 JSON")
+    parser.add_argument("--baseline", type=Path, help="与之前保存的 JSON 结果对比")
+    parser.add_argument(
+        "--show-errors", type=int, default=5, help="最多显示的识别错误数"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -21,7 +21,11 @@ class MiitApi(httpx.AsyncClient):
     token: str
 
     def __init__(self):
+        # 所有批次复用同一个客户端，连接与 cookie 保持不变，只在每批开始时刷新 token
         super().__init__(
+            http2=True,
+            limits=httpx.Limits(max_connections=4, keepalive_expiry=60),
+            timeout=httpx.Timeout(15, connect=5),
             headers={
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/101.0.4951.41 Safari/537.36 Edg/101.0.1210.32",
                 "Origin": "https://beian.miit.gov.cn",
@@ -84,8 +88,10 @@ class MiitApi(httpx.AsyncClient):
 async def main():
     data_dir = Path("data")
 
-    for i in range(100):
-        async with MiitApi() as api:
+    async with MiitApi() as api:
+        for batch in range(100):
+            if batch > 0:
+                api.token = await api.get_token()
             for i in range(8):
                 captcha = await api.get_captcha()
                 big_image_data = base64.b64decode(captcha.bigImage)
@@ -0,0 +1,141 @@
+"""
+查询服务压测
+以固定并发持续请求 /query（或 /query/list），统计吞吐量、延迟分位数、状态码分布与缓存命中率。
+配合 scripts/miit_sim.py 可以在本地完成端到端压测：
+
+    python scripts/miit_sim.py --port 9000
+    UPSTREAM__HOME_URL=http://127.0.0.1:9000/ \\
+    UPSTREAM__API_URL=http://127.0.0.1:9000/icpproject_query/api \\
+    fastapi run icp_query/app.py
+    python scripts/loadtest.py --url http://127.0.0.1:8000 --concurrency 32 --duration 30
+
+名称从一个固定大小的池中随机选取，池越小重复越多、缓存命中率越高；也可以用 --input
+指定名称文件（每行一个）。
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+
+def generate_names(count: int, unit_ratio: float, missing_ratio: float) -> list[str]:
+    """生成域名、单位名称与没有备案的名称（模拟器对 none 开头的名称返回空结果）"""
+    names = []
+    for i in range(count):
+        r = random.random()
+        if r < missing_ratio:
+            names.append(f"none{i}.com")
+        elif r < missing_ratio + unit_ratio:
+            names.append(f"压测单位{i}有限公司")
+        else:
+            names.append(f"site{i}.com")
+    return names
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.statuses: Counter[str] = Counter()
+        self.cached = 0
+
+    def record(self, latency: float, status: str, cached: bool):
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        self.cached += cached
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    names: list[str],
+    deadline: float,
+    remaining: list[int],
+    stats: Stats,
+):
+    while time.monotonic() < deadline and remaining[0] != 0:
+        remaining[0] -= 1
+        name = random.choice(names)
+        start = time.perf_counter()
+        try:
+            res = await client.get(endpoint, params={"name": name})
+            status = str(res.status_code)
+            cached = res.status_code == 200 and res.json().get("cached", False)
+        except httpx.HTTPError as e:
+            status, cached = type(e).__name__, False
+        stats.record(time.perf_counter() - start, status, cached)
+
+
+async def main(args: argparse.Namespace):
+    if args.input is not None:
+        names = [
+            line.strip()
+            for line in args.input.read_text(encoding="utf-8").splitlines()
+            if line.strip()
+        ]
+    else:
+        names = generate_names(args.names, args.unit_ratio, args.missing_ratio)
+
+    stats = Stats()
+    # 按请求数结束时 remaining 为剩余请求数，按时间结束时为 -1
+    remaining = [args.requests if args.requests is not None else -1]
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=args.timeout
+    ) as client:
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(
+            *(
+                worker(client, args.endpoint, names, deadline, remaining, stats)
+                for _ in range(args.concurrency)
+            )
+        )
+        elapsed = time.monotonic() - start
+
+    total = len(stats.latencies)
+    if total == 0:
+        print("No requests completed")
+        return
+    ms = np.array(stats.latencies) * 1000
+    print(f"Requests:    {total} in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+    print(
+        f"Latency:     p50 {np.percentile(ms, 50):.1f}ms  "
+        f"p90 {np.percentile(ms, 90):.1f}ms  "
+        f"p99 {np.percentile(ms, 99):.1f}ms  max {ms.max():.1f}ms"
+    )
+    print(f"Cached:      {stats.cached / total:.1%}")
+    print(
+        "Status:      "
+        + "  ".join(f"{status}: {n}" for status, n in stats.statuses.most_common())
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="查询服务压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="服务地址")
+    parser.add_argument(
+        "--endpoint", default="/query", choices=["/query", "/query/list"]
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, help="总请求数，达到后提前结束")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求的超时")
+    parser.add_argument("--input", type=Path, help="名称文件，每行一个")
+    parser.add_argument("--names", type=int, default=1000, help="生成的名称池大小")
+    parser.add_argument(
+        "--unit-ratio", type=float, default=0.2, help="名称池中单位名称的比例"
+    )
+    parser.add_argument(
+        "--missing-ratio", type=float, default=0.1, help="名称池中没有备案的名称比例"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
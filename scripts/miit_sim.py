@@ -0,0 +1,339 @@
+"""
+工信部备案查询接口的本地模拟器，用于端到端压测
+模拟 beian.miit.gov.cn 首页的 cookie、/auth 的 token、验证码获取与校验（解密 AES-ECB
+加密的 pointJson）以及分页的 queryByCondition，可以配置延迟、错误率与限流：
+
+    python scripts/miit_sim.py --port 9000 --fixtures data --latency 0.05 --error-rate 0.01
+
+服务指向模拟器：
+
+    UPSTREAM__HOME_URL=http://127.0.0.1:9000/ \\
+    UPSTREAM__API_URL=http://127.0.0.1:9000/icpproject_query/api \\
+    fastapi run icp_query/app.py
+
+验证码图片来自 fixtures 目录（scripts/fetch.py 保存的 big/、small/ 与
+scripts/bench_crack.py 的 labels.json）；有标注的验证码按标注校验坐标，
+没有标注或没有 fixtures（此时使用背景图合成验证码）时只检查 pointJson 能否解密。
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import secrets
+import string
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import cv2
+import numpy as np
+import uvicorn
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+from fastapi import FastAPI, Form, Header, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from icp_query.api.ratelimit import TokenBucket  # noqa: E402
+
+API = "/icpproject_query/api"
+MEDIUM_DIR = Path(__file__).resolve().parent.parent / "icp_query" / "data" / "medium"
+# 客户端提交的坐标为目标框左上角加 20
+POINT_OFFSET = 20
+
+
+class SimConfig(BaseModel):
+    latency: float = Field(0.05, ge=0, description="每个接口的平均响应延迟（秒）")
+    jitter: float = Field(0.5, ge=0, le=1, description="延迟在平均值上下浮动的比例")
+    error_rate: float = Field(0, ge=0, le=1, description="返回 HTTP 500 的比例")
+    rate_limit: float | None = Field(
+        None, gt=0, description="所有接口合计每秒处理的请求数，超出时返回限流错误"
+    )
+    burst: int = Field(10, ge=1, description="限流允许的突发请求数")
+    captcha_fail_rate: float = Field(
+        0, ge=0, le=1, description="即使坐标正确也拒绝验证码的比例"
+    )
+    tolerance: int = Field(15, ge=0, description="校验坐标时允许的误差（像素）")
+    token_ttl: float = Field(600, gt=0, description="token 有效期（秒）")
+    sign_ttl: float = Field(300, gt=0, description="sign 有效期（秒）")
+    sign_uses: int | None = Field(None, ge=1, description="每个 sign 最多使用的次数")
+    max_records: int = Field(100, ge=1, description="单位名称查询最多返回的记录数")
+
+
+class Fixture(BaseModel):
+    big: str
+    small: str
+    label: list[list[int]] | None = None
+
+
+class Challenge(BaseModel):
+    secret_key: str
+    client_uid: str
+    label: list[list[int]] | None
+
+
+class Sign(BaseModel):
+    uuid: str
+    expires_at: float
+    uses: int = 0
+
+
+def load_fixtures(directory: Path) -> list[Fixture]:
+    labels_path = directory / "labels.json"
+    labels = json.loads(labels_path.read_text()) if labels_path.exists() else {}
+    fixtures = []
+    for big in sorted((directory / "big").glob("*.png")):
+        small = directory / "small" / big.name
+        if small.exists():
+            fixtures.append(
+                Fixture(
+                    big=base64.b64encode(big.read_bytes()).decode(),
+                    small=base64.b64encode(small.read_bytes()).decode(),
+                    label=labels.get(big.stem),
+                )
+            )
+    return fixtures
+
+
+def synthetic_fixture(backgrounds: list[np.ndarray]) -> Fixture:
+    """在背景图上画 5 个字母合成验证码，没有标注"""
+    big = random.choice(backgrounds).copy()
+    letters = random.sample(string.ascii_uppercase, 5)
+    for i, letter in enumerate(letters):
+        origin = (30 + i * 90 + random.randint(0, 20), random.randint(50, 150))
+        cv2.putText(big, letter, origin, cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 4)
+    small = np.full((50, 320, 3), 255, np.uint8)
+    for letter, x in zip(letters[:4], (165, 200, 231, 265)):
+        cv2.putText(small, letter, (x, 35), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2)
+    return Fixture(
+        big=base64.b64encode(cv2.imencode(".png", big)[1].tobytes()).decode(),
+        small=base64.b64encode(cv2.imencode(".png", small)[1].tobytes()).decode(),
+    )
+
+
+def records_for(name: str, max_records: int) -> list[dict]:
+    """按名称确定性地生成备案记录：none 开头的名称没有记录，
+    域名与备案号各对应一条记录，其他视为单位名称，对应若干条记录"""
+    if name.startswith("none"):
+        return []
+    rng = random.Random(name)
+    main_id = rng.randint(1, 10**8)
+    main_licence = f"京ICP备{main_id}号"
+    if re.fullmatch(r"[\w.-]+\.[a-z]{2,}", name):
+        domains, unit_name = [name], f"{name} 运营单位"
+    elif "ICP" in name:
+        domains, unit_name = [f"site{main_id}.com"], f"备案主体{main_id}"
+        main_licence = name.split("-")[0]
+    else:
+        count = rng.randint(1, max_records)
+        domains = [f"d{i}-{main_id}.com" for i in range(count)]
+        unit_name = name
+    return [
+        {
+            "contentTypeName": "",
+            "domain": domain,
+            "domainId": main_id * 1000 + i,
+            "leaderName": "",
+            "limitAccess": "否",
+            "mainId": main_id,
+            "mainLicence": main_licence,
+            "natureName": "企业",
+            "serviceId": main_id * 1000 + i,
+            "serviceLicence": f"{main_licence}-{i + 1}",
+            "unitName": unit_name,
+            "updateRecordTime": "2024-01-01 00:00:00",
+        }
+        for i, domain in enumerate(domains)
+    ]
+
+
+def failure(msg: str, code: int = 500) -> dict:
+    return {"success": False, "code": code, "msg": msg}
+
+
+def create_app(config: SimConfig, fixtures: list[Fixture]) -> FastAPI:
+    app = FastAPI(title="MIIT simulator")
+    backgrounds = [cv2.imread(str(path)) for path in MEDIUM_DIR.glob("*.png")]
+    bucket = (
+        TokenBucket(config.rate_limit, config.burst)
+        if config.rate_limit is not None
+        else None
+    )
+    tokens: dict[str, float] = {}
+    challenges: dict[str, Challenge] = {}
+    signs: dict[str, Sign] = {}
+
+    @app.middleware("http")
+    async def chaos(request: Request, call_next):
+        if not request.url.path.startswith(API):
+            return await call_next(request)
+        if config.latency > 0:
+            spread = config.latency * config.jitter
+            await asyncio.sleep(config.latency + random.uniform(-spread, spread))
+        if random.random() < config.error_rate:
+            return Response(status_code=500)
+        if bucket is not None:
+            if bucket.delay() > 0:
+                return JSONResponse(failure("请求过于频繁，请稍后再试", 429))
+            bucket.tokens -= 1
+        return await call_next(request)
+
+    def check_token(token: str | None) -> dict | None:
+        if token is None or tokens.get(token, 0) < time.monotonic():
+            return failure("token失效", 401)
+        return None
+
+    @app.get("/")
+    async def home():
+        response = Response("<html></html>", media_type="text/html")
+        response.set_cookie("__jsluid_s", secrets.token_hex(16))
+        return response
+
+    @app.post(f"{API}/auth")
+    async def auth(request: Request, authKey: str = Form(), timeStamp: str = Form()):
+        if "__jsluid_s" not in request.cookies:
+            return Response(status_code=403)
+        expected = hashlib.md5(f"testtest{timeStamp}".encode()).hexdigest()
+        if authKey != expected:
+            return failure("authKey 错误")
+        token = secrets.token_hex(16)
+        tokens[token] = time.monotonic() + config.token_ttl
+        return {
+            "success": True,
+            "code": 200,
+            "params": {"bussiness": token, "expire": int(config.token_ttl * 1000)},
+        }
+
+    @app.post(f"{API}/image/getCheckImagePoint")
+    async def get_captcha(request: Request, token: str | None = Header(None)):
+        if (error := check_token(token)) is not None:
+            return error
+        body = await request.json()
+        fixture = (
+            random.choice(fixtures) if fixtures else synthetic_fixture(backgrounds)
+        )
+        captcha_id = str(uuid.uuid4())
+        secret_key = "".join(random.choices(string.ascii_letters + string.digits, k=16))
+        challenges[captcha_id] = Challenge(
+            secret_key=secret_key,
+            client_uid=body.get("clientUid", ""),
+            label=fixture.label,
+        )
+        return {
+            "success": True,
+            "code": 200,
+            "params": {
+                "uuid": captcha_id,
+                "bigImage": fixture.big,
+                "smallImage": fixture.small,
+                "secretKey": secret_key,
+                "wordCount": 4,
+            },
+        }
+
+    @app.post(f"{API}/image/checkImage")
+    async def check_image(request: Request, token: str | None = Header(None)):
+        if (error := check_token(token)) is not None:
+            return error
+        body = await request.json()
+        # 每个验证码只能校验一次
+        challenge = challenges.pop(body.get("token", ""), None)
+        if challenge is None or challenge.secret_key != body.get("secretKey"):
+            return failure("验证码已失效")
+        try:
+            cipher = AES.new(challenge.secret_key.encode(), AES.MODE_ECB)
+            plain = unpad(
+                cipher.decrypt(base64.b64decode(body["pointJson"])), AES.block_size
+            )
+            points = [(p["x"], p["y"]) for p in json.loads(plain)]
+        except Exception:
+            return failure("验证失败")
+        if len(points) != 4 or random.random() < config.captcha_fail_rate:
+            return failure("验证失败")
+        if challenge.label is not None and not all(
+            abs(x - lx - POINT_OFFSET) <= config.tolerance
+            and abs(y - ly - POINT_OFFSET) <= config.tolerance
+            for (x, y), (lx, ly) in zip(points, challenge.label)
+        ):
+            return failure("验证失败")
+        sign = secrets.token_hex(32)
+        signs[sign] = Sign(
+            uuid=body["token"], expires_at=time.monotonic() + config.sign_ttl
+        )
+        return {"success": True, "code": 200, "params": {"sign": sign}}
+
+    @app.post(f"{API}/icpAbbreviateInfo/queryByCondition/")
+    async def query(
+        request: Request,
+        token: str | None = Header(None),
+        sign: str | None = Header(None),
+        captcha_id: str | None = Header(None, alias="Uuid"),
+    ):
+        if (error := check_token(token)) is not None:
+            return error
+        entry = signs.get(sign or "")
+        if (
+            entry is None
+            or entry.uuid != captcha_id
+            or entry.expires_at < time.monotonic()
+            or (config.sign_uses is not None and entry.uses >= config.sign_uses)
+        ):
+            return failure("sign 无效或已过期")
+        entry.uses += 1
+
+        body = await request.json()
+        page, size = int(body.get("pageNum", 1)), int(body.get("pageSize", 40))
+        records = records_for(str(body.get("unitName", "")), config.max_records)
+        return {
+            "success": True,
+            "code": 200,
+            "params": {
+                "pageNum": page,
+                "pageSize": size,
+                "total": len(records),
+                "list": records[(page - 1) * size : page * size],
+            },
+        }
+
+    return app
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="工信部备案查询接口的本地模拟器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--fixtures", type=Path, default=Path("data"), help="包含 big/ 与 small/ 的目录"
+    )
+    for name, field in SimConfig.model_fields.items():
+        annotation = field.annotation
+        kind = int if annotation in (int, int | None) else float
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            type=kind,
+            default=field.default,
+            help=field.description,
+        )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = SimConfig.model_validate(
+        {name: getattr(args, name) for name in SimConfig.model_fields}
+    )
+    fixtures = load_fixtures(args.fixtures)
+    labelled = sum(fixture.label is not None for fixture in fixtures)
+    print(
+        f"Loaded {len(fixtures)} captcha fixtures ({labelled} labelled)"
+        if fixtures
+        else "No captcha fixtures found, serving synthetic captchas"
+    )
+    uvicorn.run(create_app(config, fixtures), host=args.host, port=args.port)
@@ -0,0 +1,19 @@
+import sys
+
+import pytest
+
+from icp_query.bulk import parse_args
+
+
+@pytest.mark.parametrize("concurrency", ["0", "-1", "x"])
+def test_concurrency_must_be_positive(monkeypatch, concurrency: str):
+    monkeypatch.setattr(
+        sys, "argv", ["bulk", "names.txt", "--concurrency", concurrency]
+    )
+    with pytest.raises(SystemExit):
+        parse_args()
+
+
+def test_concurrency_accepts_positive(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["bulk", "names.txt", "--concurrency", "3"])
+    assert parse_args().concurrency == 3
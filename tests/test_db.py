@@ -0,0 +1,61 @@
+import asyncio
+import sqlite3
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import DropIndex
+
+from icp_query.db.config import DatabaseConfig
+from icp_query.db.db import IcpRecord, get_engine, init_db
+
+
+def domain_index():
+    return next(
+        index
+        for index in IcpRecord.__table__.indexes  # type: ignore[attr-defined]
+        if index.name == "ix_icprecord_domain"
+    )
+
+
+def test_drop_index_names_table_for_mysql():
+    statement = str(DropIndex(domain_index()).compile(dialect=mysql.dialect()))
+    assert statement.strip() == "DROP INDEX ix_icprecord_domain ON icprecord"
+
+
+def test_upgrade_makes_domain_unique_and_keeps_latest_record(tmp_path):
+    path = tmp_path / "old.db"
+    # 旧版本的表：域名索引不唯一，同一域名有多条记录
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE icprecord (
+                id INTEGER PRIMARY KEY, domain VARCHAR NOT NULL,
+                unit_name VARCHAR NOT NULL, main_licence VARCHAR NOT NULL,
+                service_licence VARCHAR NOT NULL, nature_name VARCHAR NOT NULL,
+                leader_name VARCHAR, limit_access BOOLEAN NOT NULL,
+                main_id INTEGER, update_record_time DATETIME NOT NULL
+            );
+            CREATE INDEX ix_icprecord_domain ON icprecord (domain);
+            """
+        )
+        for id, domain in [(1, "a.com"), (2, "b.com"), (3, "a.com")]:
+            conn.execute(
+                "INSERT INTO icprecord VALUES "
+                "(?, ?, '单位', '京ICP备1号', '京ICP备1号-1', '企业', '', 0, 1, "
+                "'2024-01-01 00:00:00')",
+                (id, domain),
+            )
+
+    async def main():
+        await init_db(DatabaseConfig(dsn=f"sqlite+aiosqlite:///{path}"))
+        await get_engine().dispose()
+
+    asyncio.run(main())
+
+    with sqlite3.connect(path) as conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM icprecord ORDER BY id")]
+        unique = conn.execute(
+            "SELECT [unique] FROM pragma_index_list('icprecord') "
+            "WHERE name = 'ix_icprecord_domain'"
+        ).fetchone()
+    assert ids == [2, 3]
+    assert unique == (1,)
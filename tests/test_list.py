@@ -0,0 +1,75 @@
+import asyncio
+
+from icp_query import app as app_module
+from icp_query.api.models import QueryResult
+from icp_query.db import Query, RecordCache
+from icp_query.db.config import DatabaseConfig
+from icp_query.db.db import get_engine, init_db
+
+
+def make_result(domain: str) -> QueryResult:
+    return QueryResult(
+        contentTypeName="",
+        domain=domain,
+        domainId=1,
+        leaderName="",
+        limitAccess="否",
+        mainId=1,
+        mainLicence="京ICP备1号",
+        natureName="企业",
+        serviceId=1,
+        serviceLicence="京ICP备1号-1",
+        unitName="多域名单位",
+        updateRecordTime="2024-01-01 00:00:00",
+    )
+
+
+class PagedSessionPool:
+    """单位名下有 60 个域名，每页 40 条"""
+
+    circuit_open = False
+
+    def __init__(self):
+        self.results = [make_result(f"site{i}.com") for i in range(60)]
+        self.pages = 0
+
+    async def lookup(self, name: str, page=1) -> list[QueryResult]:
+        self.pages += 1
+        return self.results[(page - 1) * 40 : page * 40]
+
+    async def lookup_all(self, name: str) -> list[QueryResult]:
+        return await self.lookup(name, 1) + await self.lookup(name, 2)
+
+
+def test_list_fetches_every_page_after_first_page_lookup(tmp_path):
+    async def main():
+        await init_db(DatabaseConfig(dsn=f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+        session_pool = PagedSessionPool()
+        query = Query(get_engine(), RecordCache(app_module.cm.cache))
+        try:
+            # /query 只保存第一页
+            await app_module.query_icp("多域名单位", session_pool, query)  # type: ignore[arg-type]
+            assert session_pool.pages == 1
+
+            response = await app_module.query_icp_list(
+                "多域名单位",
+                session_pool,  # type: ignore[arg-type]
+                query,
+            )
+            assert not response.cached
+            assert len(response.records) == 60
+            assert session_pool.pages == 3
+
+            # 抓取过全部分页后直接使用数据库中的记录
+            response = await app_module.query_icp_list(
+                "多域名单位",
+                session_pool,  # type: ignore[arg-type]
+                query,
+            )
+            assert response.cached
+            assert len(response.records) == 60
+            assert session_pool.pages == 3
+        finally:
+            await get_engine().dispose()
+
+    asyncio.run(main())
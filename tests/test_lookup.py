@@ -0,0 +1,29 @@
+import pytest
+
+from icp_query.db.lookup import LookupKey, lookup_key
+
+
+@pytest.mark.parametrize(
+    "name, field, value",
+    [
+        ("https://WWW.Example.com/path?q=1", "domain", "example.com"),
+        ("ＥＸＡＭＰＬＥ．ＣＯＭ", "domain", "example.com"),
+        ("京ICP备12345678号", "main_licence", "京ICP备12345678号"),
+        ("京ICP备12345678号-1", "service_licence", "京ICP备12345678号-1"),
+        ("Example Co.Ltd", "unit_name", "Example Co.Ltd"),
+        ("something.cn公司", "unit_name", "something.cn公司"),
+        ("测试(北京)有限公司", "unit_name", "测试（北京）有限公司"),
+    ],
+)
+def test_lookup_key(name: str, field: str, value: str):
+    key = lookup_key(name)
+    assert (key.field, key.value) == (field, value)
+
+
+def test_unit_name_queries_upstream_with_original_input():
+    key = lookup_key("  Example   Co.Ltd ")
+    assert key == LookupKey("unit_name", "Example Co.Ltd")
+    assert key.upstream == "Example   Co.Ltd"
+    # 规范化后的值相同即共享缓存
+    assert hash(key) == hash(lookup_key("Example Co.Ltd"))
+    assert lookup_key("WWW.example.com").upstream == "example.com"
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from pydantic import ValidationError
+
+from icp_query.api.config import UpstreamConfig
+from icp_query.api.miit import (
+    AuthError,
+    MiitApi,
+    MiitError,
+    ThrottledError,
+    TokenExpiredError,
+    classify,
+    is_overload,
+    raise_for_result,
+)
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.com/")
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+@pytest.mark.parametrize(
+    "d, error",
+    [
+        ({"success": False, "code": 401, "msg": "token失效"}, TokenExpiredError),
+        (
+            {"success": False, "code": 429, "msg": "请求过于频繁，请稍后再试"},
+            ThrottledError,
+        ),
+        ({"success": False, "code": 500, "msg": "系统繁忙"}, ThrottledError),
+        ({"success": False, "code": 500, "msg": "sign 已过期"}, AuthError),
+        ({"success": False, "code": 500, "msg": "参数错误"}, MiitError),
+    ],
+)
+def test_raise_for_result(d: dict, error: type[Exception]):
+    with pytest.raises(error) as exc_info:
+        raise_for_result(d)
+    assert type(exc_info.value) is error
+
+
+@pytest.mark.parametrize(
+    "e, kind",
+    [
+        (ThrottledError("throttled"), "throttled"),
+        (status_error(429), "throttled"),
+        (status_error(502), "throttled"),
+        (status_error(404), "other"),
+        (MiitError("query failed: 参数错误"), "other"),
+        (httpx.ConnectError("refused"), "network"),
+    ],
+)
+def test_only_overload_errors_are_throttled(e: Exception, kind: str):
+    assert classify(e) == kind
+    assert is_overload(e) == (kind in ("throttled", "network"))
+
+
+def test_token_refresh_margin_must_be_below_ttl():
+    with pytest.raises(ValidationError):
+        UpstreamConfig(token_ttl=30, token_refresh_margin=30)
+
+
+@pytest.mark.parametrize("expire, delay", [(300_000, 270), (20_000, 10)])
+def test_token_refresh_waits_at_least_half_the_ttl(expire: int, delay: float):
+    async def main():
+        api = MiitApi(UpstreamConfig(token_refresh_margin=30))
+
+        async def post(url, **kwargs):
+            return httpx.Response(
+                200,
+                json={"success": True, "params": {"bussiness": "t", "expire": expire}},
+                request=httpx.Request("POST", url),
+            )
+
+        api.post = post  # type: ignore[method-assign]
+        start = time.monotonic()
+        assert await api.get_token() == "t"
+        assert api.token_refresh_at - start == pytest.approx(delay, abs=1)
+        await api.aclose()
+
+    asyncio.run(main())
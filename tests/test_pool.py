@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from icp_query.api.config import AuthPoolConfig
+from icp_query.api.miit import AuthError, AuthTimeoutError
+from icp_query.api.pool import AuthPool
+from icp_query.api.retry import CircuitOpenError
+
+
+def test_acquire_times_out_without_auth():
+    async def main():
+        # 未启动后台补充任务，池中一直没有认证
+        pool = AuthPool(AuthPoolConfig(acquire_timeout=0.05))
+        start = time.monotonic()
+        with pytest.raises(AuthTimeoutError):
+            await pool.acquire()
+        assert time.monotonic() - start < 1
+        assert pool.waiters == 0
+
+    asyncio.run(main())
+
+
+def test_circuit_open_wakes_waiters():
+    async def main():
+        pool = AuthPool(AuthPoolConfig(acquire_timeout=None))
+        waiters = [asyncio.create_task(pool.acquire()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert pool.waiters == 3
+        for _ in range(pool.breaker.config.failure_threshold):
+            pool.breaker.record(True)
+        results = await asyncio.wait_for(
+            asyncio.gather(*waiters, return_exceptions=True), 1
+        )
+        assert all(isinstance(e, CircuitOpenError) for e in results)
+
+    asyncio.run(main())
+
+
+def test_retired_lease_wakes_refill_for_sharing_waiter():
+    async def main():
+        config = AuthPoolConfig(low_watermark=0, high_watermark=1, acquire_timeout=1)
+        pool = AuthPool(config)
+        solves = 0
+
+        async def solve_captcha():
+            nonlocal solves
+            solves += 1
+            return f"uuid{solves}", "sign"
+
+        pool.solve_captcha = solve_captcha  # type: ignore[method-assign]
+        worker = asyncio.create_task(pool._refill_worker())
+        try:
+            lease = await pool.acquire()
+            # 第二个请求共享已借出的租约，不额外求解
+            waiter = asyncio.create_task(pool.acquire())
+            await asyncio.sleep(0.01)
+            assert solves == 1
+            await pool.release(lease, AuthError("auth rejected"))
+            second = await asyncio.wait_for(waiter, 0.5)
+            assert second.uuid == "uuid2"
+        finally:
+            worker.cancel()
+
+    asyncio.run(main())
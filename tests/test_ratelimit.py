@@ -0,0 +1,38 @@
+from icp_query.api.config import AdaptiveConcurrencyConfig
+from icp_query.api.ratelimit import AdaptiveLimiter
+
+
+def make_limiter(**kwargs) -> AdaptiveLimiter:
+    config = AdaptiveConcurrencyConfig(cooldown=0, **kwargs)
+    return AdaptiveLimiter(config)
+
+
+def release(limiter: AdaptiveLimiter, latency: float, endpoint: str = "query"):
+    limiter.inflight += 1
+    limiter.release(latency, endpoint=endpoint)
+
+
+def test_baseline_follows_sustained_latency_increase():
+    limiter = make_limiter(initial=16, max_limit=64)
+    for _ in range(100):
+        release(limiter, 0.1)
+    # 上游延迟整体上升到基线的 2.5 倍并保持不变
+    for _ in range(500):
+        release(limiter, 0.25)
+    assert limiter.latency["query"] > 0.2
+    assert limiter.limit > limiter.config.min_limit * 4
+
+
+def test_latency_baseline_is_per_endpoint():
+    limiter = make_limiter(initial=16)
+    for _ in range(50):
+        release(limiter, 0.05, "get_captcha")
+        release(limiter, 0.5, "query")
+    limit = limiter.limit
+    # 查询比验证码慢得多是常态，不应被当作延迟突增
+    for _ in range(20):
+        release(limiter, 0.5, "query")
+        release(limiter, 0.05, "get_captcha")
+    assert limiter.limit >= limit
+    release(limiter, 0.5, "get_captcha")
+    assert limiter.limit < limit
@@ -0,0 +1,54 @@
+import asyncio
+
+from icp_query.db.config import CacheConfig
+from icp_query.refresher import Refresher
+
+
+def test_refresher_bounds_concurrency_and_queue():
+    async def main():
+        config = CacheConfig(refresh_concurrency=2, refresh_queue_size=5)
+        active = peak = done = 0
+
+        async def refresh():
+            nonlocal active, peak, done
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            done += 1
+
+        async with Refresher(config) as refresher:
+            queued = [refresher.submit(i, refresh) for i in range(50)]
+            # 排队或刷新中的键不重复添加
+            assert not refresher.submit(0, refresh)
+            assert sum(queued) == 5
+            assert len(refresher) == 5
+            while len(refresher):
+                await asyncio.sleep(0.01)
+
+        assert done == 5
+        assert peak == 2
+        # 刷新完成后同一个键可以再次排队
+        assert refresher.submit(0, refresh)
+
+    asyncio.run(main())
+
+
+def test_refresher_survives_failed_refresh():
+    async def main():
+        calls = []
+
+        async def refresh(key: int):
+            calls.append(key)
+            if key == 0:
+                raise ValueError("upstream error")
+
+        async with Refresher(CacheConfig(refresh_concurrency=1)) as refresher:
+            refresher.submit(0, lambda: refresh(0))
+            refresher.submit(1, lambda: refresh(1))
+            while len(refresher):
+                await asyncio.sleep(0.01)
+
+        assert calls == [0, 1]
+
+    asyncio.run(main())
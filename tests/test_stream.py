@@ -0,0 +1,122 @@
+import asyncio
+
+from icp_query import app as app_module
+from icp_query.api.models import QueryResult
+from icp_query.db.config import DatabaseConfig
+from icp_query.db.db import get_engine, init_db
+
+
+def make_result(name: str) -> QueryResult:
+    return QueryResult(
+        contentTypeName="",
+        domain=name,
+        domainId=1,
+        leaderName="",
+        limitAccess="否",
+        mainId=1,
+        mainLicence="京ICP备1号",
+        natureName="企业",
+        serviceId=1,
+        serviceLicence="京ICP备1号-1",
+        unitName="测试单位",
+        updateRecordTime="2024-01-01 00:00:00",
+    )
+
+
+class FakeSessionPool:
+    circuit_open = False
+
+    def __init__(self):
+        self.lookups = 0
+
+    def check_circuit(self):
+        pass
+
+    async def lookup(self, name: str, page=1) -> list[QueryResult]:
+        self.lookups += 1
+        await asyncio.sleep(0.01)
+        return [make_result(name)]
+
+    async def lookup_all(self, name: str) -> list[QueryResult]:
+        return await self.lookup(name)
+
+
+async def post_stream(names: list[str], disconnect_after: int | None) -> int:
+    """直接调用 ASGI 应用，收到 disconnect_after 行结果后模拟客户端断开，返回收到的行数"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/query/stream",
+        "raw_path": b"/query/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"text/plain")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    messages = [
+        {
+            "type": "http.request",
+            "body": "".join(f"{name}\n" for name in names).encode(),
+            "more_body": False,
+        }
+    ]
+    disconnected = asyncio.Event()
+    lines = 0
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal lines
+        # 与 uvicorn 一致，断开后的 send 被静默丢弃
+        if message["type"] == "http.response.body" and not disconnected.is_set():
+            lines += message.get("body", b"").count(b"\n")
+            if disconnect_after is not None and lines >= disconnect_after:
+                disconnected.set()
+
+    await asyncio.wait_for(app_module.app(scope, receive, send), timeout=30)
+    return lines
+
+
+def run_with_pool(tmp_path, test):
+    async def main():
+        await init_db(DatabaseConfig(dsn=f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+        session_pool = FakeSessionPool()
+        app_module.session_pool = session_pool  # type: ignore[assignment]
+        try:
+            await test(session_pool)
+        finally:
+            app_module.session_pool = None
+            await get_engine().dispose()
+
+    asyncio.run(main())
+
+
+def test_stream_returns_every_name(tmp_path):
+    async def test(session_pool: FakeSessionPool):
+        names = [f"complete{i}.com" for i in range(50)]
+        assert await post_stream(names, disconnect_after=None) == 50
+        assert session_pool.lookups == 50
+
+    run_with_pool(tmp_path, test)
+
+
+def test_stream_stops_lookups_after_client_disconnects(tmp_path):
+    async def test(session_pool: FakeSessionPool):
+        names = [f"abandoned{i}.com" for i in range(200)]
+        await post_stream(names, disconnect_after=32)
+        lookups = session_pool.lookups
+        assert lookups <= 32 + app_module.cm.batch.concurrency
+
+        # 已取消的查询不会继续进行
+        await asyncio.sleep(0.2)
+        assert session_pool.lookups == lookups
+
+    run_with_pool(tmp_path, test)